@@ -1,18 +1,23 @@
 from typing import Annotated
 from typing_extensions import TypedDict
 from langgraph.graph.message import AnyMessage, add_messages
-from langchain_core.messages import ToolMessage
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
 from langchain_core.runnables import RunnableLambda
 from langgraph.prebuilt import ToolNode
 from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START
 from langgraph.prebuilt import tools_condition
 from datetime import datetime
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import Runnable, RunnableConfig
-from chat_app.backend.chatbot_tools import list_contacts,create_contact, get_contact_details, find_contact, send_email, generate_chart, retriever_tool
+from chatbot_tools import list_contacts,create_contact, get_contact_details, find_contact, send_email, generate_chart, retriever_tool
+from checkpointer import create_checkpointer
+from context_packer import count_tokens
+from llm_cache import get_llm_cache
+from tool_guard import guard_tools
 from dotenv import load_dotenv
+import asyncio
+import time
 import os
 
 load_dotenv()
@@ -45,32 +50,71 @@ def create_tool_node_with_fallback(tools: list) -> dict:
 
 class State(TypedDict):
     messages: Annotated[list[AnyMessage], add_messages]
+    # Rolling summary of turns that were dropped from `messages` to bound the prompt
+    summary: str
 
 
 
+ASSISTANT_MAX_RETRIES = int(os.getenv("ASSISTANT_MAX_RETRIES", "3"))
+ASSISTANT_RETRY_BACKOFF = float(os.getenv("ASSISTANT_RETRY_BACKOFF", "0.5"))
+ASSISTANT_TURN_TIMEOUT = float(os.getenv("ASSISTANT_TURN_TIMEOUT", "90"))
+
+EMPTY_RESPONSE_FALLBACK = "Sorry, I couldn't produce a response just now. Please try asking again."
+
+
+def is_empty_response(result) -> bool:
+    return not result.tool_calls and (
+        not result.content
+        or isinstance(result.content, list)
+        and not result.content[0].get("text")
+    )
+
+
 class Assistant:
-    def __init__(self, runnable: Runnable):
+    def __init__(self, runnable: Runnable, max_retries: int = ASSISTANT_MAX_RETRIES,
+                 backoff: float = ASSISTANT_RETRY_BACKOFF, timeout: float = ASSISTANT_TURN_TIMEOUT):
         self.runnable = runnable
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    def _prepare(self, state: State, config: RunnableConfig) -> State:
+        configuration = config.get("configurable", {})
+        passenger_id = configuration.get("passenger_id", None)
+        return {**state, "user_info": passenger_id, "summary": state.get("summary", "")}
+
+    @staticmethod
+    def _reprompt(state: State) -> State:
+        messages = state["messages"] + [("user", "Respond with a real output.")]
+        return {**state, "messages": messages}
 
     def __call__(self, state: State, config: RunnableConfig):
-        while True:
-            configuration = config.get("configurable", {})
-            passenger_id = configuration.get("passenger_id", None)
-            state = {**state, "user_info": passenger_id}
-            result = self.runnable.invoke(state)
-
-            if not result.tool_calls and (
-                not result.content
-                or isinstance(result.content, list)
-                and not result.content[0].get("text")
-            ):
-                messages = state["messages"] + [("user", "Respond with a real output.")]
-                state = {**state, "messages": messages}
-            else:
-                break
-        return {"messages": result}
+        state = self._prepare(state, config)
+        for attempt in range(self.max_retries + 1):
+            result = self.runnable.invoke(state, config)
+            if not is_empty_response(result):
+                return {"messages": result}
+            state = self._reprompt(state)
+            if attempt < self.max_retries:
+                time.sleep(self.backoff * 2 ** attempt)
+        return {"messages": AIMessage(content=EMPTY_RESPONSE_FALLBACK)}
 
-llm = ChatOpenAI(model_name='gpt-4o-2024-08-06', temperature=0)
+    async def acall(self, state: State, config: RunnableConfig):
+        return await asyncio.wait_for(self._acall(state, config), timeout=self.timeout)
+
+    async def _acall(self, state: State, config: RunnableConfig):
+        state = self._prepare(state, config)
+        for attempt in range(self.max_retries + 1):
+            result = await self.runnable.ainvoke(state, config)
+            if not is_empty_response(result):
+                return {"messages": result}
+            print(f"Assistant returned an empty response (attempt {attempt + 1}), re-prompting")
+            state = self._reprompt(state)
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        return {"messages": AIMessage(content=EMPTY_RESPONSE_FALLBACK)}
+
+llm = ChatOpenAI(model_name='gpt-4o-2024-08-06', temperature=0, cache=get_llm_cache())
 
 primary_assistant_prompt = ChatPromptTemplate.from_messages(
     [
@@ -106,6 +150,7 @@ primary_assistant_prompt = ChatPromptTemplate.from_messages(
             "- Query the user suggested contacts if they provided names only.\n"
             "- Ask for email addresses from the user if the requested contacts are not available.\n"
             "- Show a final draft of the email with recipients, cc, and bcc before sending it."
+            "\n\nSummary of the earlier conversation (empty if there is none):\n{summary}"
         ),
         ("placeholder", "{messages}"),
     ]
@@ -118,14 +163,110 @@ assistant = primary_assistant_prompt | llm.bind_tools(tools)
 
 
 
+# History management: keep a token-budgeted window of recent turns and fold older ones into a summary
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# Once over budget, trim down to this fraction of it so a summary is needed only every few turns
+HISTORY_LOW_WATER = float(os.getenv("HISTORY_LOW_WATER", "0.55"))
+STALE_TOOL_RESULT_CHARS = int(os.getenv("STALE_TOOL_RESULT_CHARS", "1500"))
+TRUNCATION_MARKER = "\n[truncated]"
+
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between a user and the company assistant. "
+    "Keep facts, names, email addresses, decisions and open requests; drop pleasantries. "
+    "Answer with the updated summary only."
+)
+
+
+def message_tokens(message) -> int:
+    return count_tokens(str(message.content)) + 4
+
+
+def plan_history(state: State):
+    """Work out which messages to summarize away and which stale tool results to shorten.
+
+    Returns (old_messages, truncated_messages). Once the history exceeds HISTORY_TOKEN_BUDGET it is
+    cut down to HISTORY_LOW_WATER of the budget, so the summary call doesn't run on every turn. Cuts
+    only happen at human turns so an AI tool call is never separated from its tool results.
+    """
+    messages = state["messages"]
+    turn_starts = [i for i, message in enumerate(messages) if isinstance(message, HumanMessage)]
+    current_turn = turn_starts[-1] if turn_starts else 0
+
+    # Tool payloads from earlier turns have already been answered, a short excerpt is enough
+    truncated = {}
+    for message in messages[:current_turn]:
+        content = str(message.content)
+        if (isinstance(message, ToolMessage) and len(content) > STALE_TOOL_RESULT_CHARS
+                and not content.endswith(TRUNCATION_MARKER)):
+            truncated[message.id] = ToolMessage(
+                id=message.id,
+                content=content[:STALE_TOOL_RESULT_CHARS] + TRUNCATION_MARKER,
+                tool_call_id=message.tool_call_id,
+                name=message.name,
+            )
+
+    sizes = [message_tokens(truncated.get(message.id, message)) for message in messages]
+    cut = 0
+    if sum(sizes) > HISTORY_TOKEN_BUDGET:
+        target = HISTORY_TOKEN_BUDGET * HISTORY_LOW_WATER
+        cut = current_turn
+        for start in turn_starts:
+            if sum(sizes[start:]) <= target:
+                cut = start
+                break
+
+    old = messages[:cut]
+    old_ids = {message.id for message in old}
+    return old, [message for message in truncated.values() if message.id not in old_ids]
+
+
+def summary_request(summary: str, old_messages) -> list:
+    transcript = "\n".join(
+        f"{type(message).__name__.replace('Message', '')}: {str(message.content)[:STALE_TOOL_RESULT_CHARS]}"
+        for message in old_messages
+    )
+    return [
+        SystemMessage(content=SUMMARY_PROMPT),
+        HumanMessage(content=f"Current summary:\n{summary or '(none)'}\n\nConversation to add:\n{transcript}"),
+    ]
+
+
+def history_update(old, truncated, summary: str = None) -> dict:
+    update = {"messages": [RemoveMessage(id=message.id) for message in old] + truncated}
+    if summary is not None:
+        update["summary"] = summary
+    return update
+
+
+def manage_history(state: State, config: RunnableConfig):
+    old, truncated = plan_history(state)
+    summary = None
+    if old:
+        summary = llm.invoke(summary_request(state.get("summary", ""), old), config).content
+    return history_update(old, truncated, summary)
+
+
+async def amanage_history(state: State, config: RunnableConfig):
+    old, truncated = plan_history(state)
+    summary = None
+    if old:
+        summary = (await llm.ainvoke(summary_request(state.get("summary", ""), old), config)).content
+    return history_update(old, truncated, summary)
+
+
 builder = StateGraph(State)
 
 
 # Define nodes: these do the work
-builder.add_node("assistant", Assistant(assistant))
-builder.add_node("tools", create_tool_node_with_fallback(tools))
+builder.add_node("manage_history", RunnableLambda(manage_history, afunc=amanage_history, name="manage_history"))
+assistant_node = Assistant(assistant)
+builder.add_node("assistant", RunnableLambda(assistant_node, afunc=assistant_node.acall, name="assistant"))
+# Guarded tools run on the event loop with per-tool deadlines and per-upstream circuit breakers;
+# ToolNode executes the tool calls of one step concurrently.
+builder.add_node("tools", create_tool_node_with_fallback(guard_tools(tools)))
 # Define edges: these determine how the control flow moves
-builder.add_edge(START, "assistant")
+builder.add_edge(START, "manage_history")
+builder.add_edge("manage_history", "assistant")
 builder.add_conditional_edges(
     "assistant",
     tools_condition,
@@ -134,7 +275,8 @@ builder.add_edge("tools", "assistant")
 
 # The checkpointer lets the graph persist its state
 # this is a complete memory for the entire graph.
-memory = MemorySaver()
+# Set CHECKPOINTER=postgres to share it across workers; the default stays in-process.
+memory = create_checkpointer()
 agent = builder.compile(checkpointer=memory)
 
 
@@ -0,0 +1,70 @@
+"""Compare FAISS index types on a saved vector store.
+
+Reports recall@k against exact (flat) search, per-query latency, build time and index size for
+each index type, using the chunk vectors of an existing store and a file of queries (one per line).
+
+    python benchmark_index.py Path_for_vectorstore/my_store queries.txt --k 4
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+from langchain_openai import OpenAIEmbeddings
+
+from embedding_cache import CachedEmbeddings
+from vector_index import INDEX_TYPES, build_index, load_vector_store
+
+
+def measure(index, queries: np.ndarray, k: int):
+    latencies = []
+    results = []
+    for query in queries:
+        started = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies)
+
+
+def recall_at_k(results: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(found) & set(expected)) / k for found, expected in zip(results, truth)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark recall@k, latency and memory of FAISS index types.")
+    parser.add_argument("folder_path", help="Vector store folder written by store.py.")
+    parser.add_argument("queries", help="Text file with one query per line.")
+    parser.add_argument("--index-name", default="faiss.index")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    args = parser.parse_args()
+
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+    vectordb = load_vector_store(args.folder_path, args.index_name, embeddings, mmap=False)
+    vectors = vectordb.index.reconstruct_n(0, vectordb.index.ntotal)
+
+    with open(args.queries) as f:
+        query_texts = [line.strip() for line in f if line.strip()]
+    queries = np.asarray(embeddings.embed_documents(query_texts), dtype=np.float32)
+
+    print(f"{len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+
+    _, truth = vectordb.index.search(queries, args.k)
+
+    print(f"{'type':<6} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'size MB':>8} {'build s':>8}")
+    for index_type in args.types:
+        started = time.perf_counter()
+        index = build_index(vectors, index_type)
+        build_time = time.perf_counter() - started
+
+        results, latencies = measure(index, queries, args.k)
+        size_mb = faiss.serialize_index(index).nbytes / (1024 * 1024)
+
+        print(f"{index_type:<6} {recall_at_k(results, truth):>9.3f} {np.percentile(latencies, 50):>8.3f} "
+              f"{np.percentile(latencies, 95):>8.3f} {size_mb:>8.1f} {build_time:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+from typing import Optional
+from xml.sax.saxutils import escape
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+CHART_DIR = os.getenv("CHART_DIR", "cache/charts")
+CHART_MEMORY_CACHE_SIZE = int(os.getenv("CHART_MEMORY_CACHE_SIZE", "256"))
+
+CHART_TYPES = ("bar", "pie", "line", "area")
+PALETTE = ["#4e79a7", "#f28e2b", "#e15759", "#76b7b2", "#59a14f", "#edc948", "#b07aa1", "#ff9da7", "#9c755f", "#bab0ac"]
+
+WIDTH, HEIGHT = 800, 500
+MARGIN_LEFT, MARGIN_RIGHT, MARGIN_TOP, MARGIN_BOTTOM = 70, 160, 60, 60
+
+
+def chart_key(chart_type: str, data: dict, title: Optional[str]) -> str:
+    """Content hash of a chart request; identical requests map to the same SVG."""
+    canonical = json.dumps({"chart_type": chart_type, "data": data, "title": title}, sort_keys=True)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def _number(value: float) -> str:
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def _color(i: int) -> str:
+    return PALETTE[i % len(PALETTE)]
+
+
+def _legend(labels) -> list:
+    parts = []
+    for i, label in enumerate(labels):
+        y = MARGIN_TOP + i * 22
+        parts.append(f'<rect x="{WIDTH - MARGIN_RIGHT + 20}" y="{y}" width="14" height="14" fill="{_color(i)}"/>')
+        parts.append(f'<text x="{WIDTH - MARGIN_RIGHT + 40}" y="{y + 12}" font-size="13">{escape(str(label))}</text>')
+    return parts
+
+
+def _axes(low: float, high: float) -> tuple:
+    """Draw the y axis with gridlines; returns the SVG parts and a value -> y coordinate function."""
+    plot_height = HEIGHT - MARGIN_TOP - MARGIN_BOTTOM
+    span = (high - low) or 1.0
+
+    def y_of(value):
+        return MARGIN_TOP + plot_height * (1 - (value - low) / span)
+
+    parts = []
+    for i in range(6):
+        value = low + span * i / 5
+        y = y_of(value)
+        parts.append(f'<line x1="{MARGIN_LEFT}" y1="{y:.1f}" x2="{WIDTH - MARGIN_RIGHT}" y2="{y:.1f}" stroke="#e0e0e0"/>')
+        parts.append(f'<text x="{MARGIN_LEFT - 8}" y="{y + 4:.1f}" font-size="12" text-anchor="end">{_number(value)}</text>')
+    parts.append(f'<line x1="{MARGIN_LEFT}" y1="{y_of(max(low, 0)):.1f}" x2="{WIDTH - MARGIN_RIGHT}" '
+                 f'y2="{y_of(max(low, 0)):.1f}" stroke="#333"/>')
+    return parts, y_of
+
+
+def _bounds(values) -> tuple:
+    return min(min(values), 0), max(max(values), 0)
+
+
+def _bar(data: dict) -> list:
+    categories = list(data)
+    series_count = max(len(values) for values in data.values())
+    parts, y_of = _axes(*_bounds([value for values in data.values() for value in values]))
+
+    group_width = (WIDTH - MARGIN_LEFT - MARGIN_RIGHT) / len(categories)
+    bar_width = group_width * 0.8 / series_count
+    for i, category in enumerate(categories):
+        group_x = MARGIN_LEFT + i * group_width + group_width * 0.1
+        for j, value in enumerate(data[category]):
+            top, bottom = sorted((y_of(value), y_of(0)))
+            parts.append(f'<rect x="{group_x + j * bar_width:.1f}" y="{top:.1f}" width="{bar_width:.1f}" '
+                         f'height="{bottom - top:.1f}" fill="{_color(j)}"><title>{escape(str(category))}: {_number(value)}</title></rect>')
+        parts.append(f'<text x="{group_x + group_width * 0.4:.1f}" y="{HEIGHT - MARGIN_BOTTOM + 20}" font-size="12" '
+                     f'text-anchor="middle">{escape(str(category))}</text>')
+
+    if series_count > 1:
+        parts += _legend([f"Series {j + 1}" for j in range(series_count)])
+    return parts
+
+
+def _line(data: dict, filled: bool) -> list:
+    points_count = max(len(values) for values in data.values())
+    parts, y_of = _axes(*_bounds([value for values in data.values() for value in values]))
+
+    step = (WIDTH - MARGIN_LEFT - MARGIN_RIGHT) / max(points_count - 1, 1)
+    for i, (label, values) in enumerate(data.items()):
+        points = [(MARGIN_LEFT + k * step, y_of(value)) for k, value in enumerate(values)]
+        path = " ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+        if filled:
+            baseline = y_of(0)
+            area = f"{points[0][0]:.1f},{baseline:.1f} {path} {points[-1][0]:.1f},{baseline:.1f}"
+            parts.append(f'<polygon points="{area}" fill="{_color(i)}" fill-opacity="0.35" stroke="none"/>')
+        parts.append(f'<polyline points="{path}" fill="none" stroke="{_color(i)}" stroke-width="2"/>')
+        for x, y in points:
+            parts.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="3" fill="{_color(i)}"/>')
+
+    for k in range(points_count):
+        parts.append(f'<text x="{MARGIN_LEFT + k * step:.1f}" y="{HEIGHT - MARGIN_BOTTOM + 20}" font-size="12" '
+                     f'text-anchor="middle">{k + 1}</text>')
+    return parts + _legend(list(data))
+
+
+def _pie(data: dict) -> list:
+    totals = {label: sum(values) for label, values in data.items()}
+    total = sum(value for value in totals.values() if value > 0) or 1.0
+    cx, cy = MARGIN_LEFT + (WIDTH - MARGIN_LEFT - MARGIN_RIGHT) / 2, MARGIN_TOP + (HEIGHT - MARGIN_TOP - MARGIN_BOTTOM) / 2
+    radius = min(WIDTH - MARGIN_LEFT - MARGIN_RIGHT, HEIGHT - MARGIN_TOP - MARGIN_BOTTOM) / 2
+
+    parts = []
+    angle = -math.pi / 2
+    for i, (label, value) in enumerate(totals.items()):
+        if value <= 0:
+            continue
+        sweep = 2 * math.pi * value / total
+        tooltip = f"<title>{escape(str(label))}: {_number(value)} ({100 * value / total:.1f}%)</title>"
+        if sweep >= 2 * math.pi - 1e-9:
+            parts.append(f'<circle cx="{cx:.1f}" cy="{cy:.1f}" r="{radius:.1f}" fill="{_color(i)}">{tooltip}</circle>')
+        else:
+            x1, y1 = cx + radius * math.cos(angle), cy + radius * math.sin(angle)
+            x2, y2 = cx + radius * math.cos(angle + sweep), cy + radius * math.sin(angle + sweep)
+            large_arc = 1 if sweep > math.pi else 0
+            parts.append(f'<path d="M{cx:.1f},{cy:.1f} L{x1:.1f},{y1:.1f} A{radius:.1f},{radius:.1f} 0 {large_arc} 1 '
+                         f'{x2:.1f},{y2:.1f} Z" fill="{_color(i)}" stroke="#fff">{tooltip}</path>')
+        angle += sweep
+    return parts + _legend(list(totals))
+
+
+def render_svg(chart_type: str, data: dict, title: Optional[str] = None) -> str:
+    """Render a chart from the generate_chart schema: {category: [numbers, ...], ...}."""
+    if chart_type not in CHART_TYPES:
+        raise ValueError(f"Unsupported chart type {chart_type!r}, expected one of {', '.join(CHART_TYPES)}.")
+    if not data or not all(isinstance(values, list) and values for values in data.values()):
+        raise ValueError("Data must map each category to a non-empty list of numbers.")
+    try:
+        data = {str(label): [float(value) for value in values] for label, values in data.items()}
+    except (TypeError, ValueError):
+        raise ValueError("Data values must be plain numbers, e.g. {\"Category1\": [10, 20, 30]}.")
+
+    if chart_type == "bar":
+        parts = _bar(data)
+    elif chart_type == "pie":
+        parts = _pie(data)
+    else:
+        parts = _line(data, filled=chart_type == "area")
+
+    if title:
+        parts.insert(0, f'<text x="{WIDTH / 2}" y="32" font-size="20" font-weight="bold" text-anchor="middle">{escape(title)}</text>')
+
+    body = "\n".join(parts)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{WIDTH}" height="{HEIGHT}" viewBox="0 0 {WIDTH} {HEIGHT}" '
+            f'font-family="Helvetica, Arial, sans-serif">\n<rect width="100%" height="100%" fill="#fff"/>\n{body}\n</svg>')
+
+
+class ChartStore:
+    """Rendered charts by content hash: a small in-memory LRU in front of files in CHART_DIR."""
+
+    def __init__(self, directory: str = CHART_DIR, memory_size: int = CHART_MEMORY_CACHE_SIZE):
+        self.directory = directory
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.svg")
+
+    def _remember(self, key: str, svg: str):
+        with self._lock:
+            self._memory[key] = svg
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                svg = f.read()
+        except FileNotFoundError:
+            return None
+        self._remember(key, svg)
+        return svg
+
+    def render(self, chart_type: str, data: dict, title: Optional[str] = None) -> str:
+        """Return the key of the chart, rendering and storing it only if it hasn't been seen before."""
+        key = chart_key(chart_type, data, title)
+        if self.get(key) is not None:
+            return key
+
+        svg = render_svg(chart_type, data, title)
+        with open(f"{self._path(key)}.tmp", "w", encoding="utf-8") as f:
+            f.write(svg)
+        os.replace(f"{self._path(key)}.tmp", self._path(key))
+        self._remember(key, svg)
+        return key
+
+
+chart_store = ChartStore()
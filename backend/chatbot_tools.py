@@ -1,37 +1,211 @@
-import requests
 from langchain_core.tools import tool
 from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain_openai import ChatOpenAI
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from dotenv import load_dotenv
-from json_repair import repair_json
 from langchain import hub
+from langchain_core.prompts import ChatPromptTemplate
+from http_client import check_upstream, request
+from semantic_cache import SemanticCache, code_terms
+from embedding_cache import CachedEmbeddings
+from llm_cache import get_llm_cache
+from vector_index import load_vector_store
+from hybrid_search import BM25Index, HybridRetriever
+from context_packer import pack_context
+from langchain_core.runnables import RunnableLambda
+from cachetools import TTLCache
+from charts import chart_store
+import asyncio
+import functools
+import hashlib
+import json
+import threading
 import os
 
 load_dotenv()
 
 CONTACTS_URL = os.getenv('CONTACTS_URL')
 CHART_URL = os.getenv('CHART_URL')
-
-vectorstore = FAISS.load_local(
-    folder_path="Vector_store/new_alfred",
-    embeddings=OpenAIEmbeddings(),
-    index_name="faiss.index",
-    allow_dangerous_deserialization=True
+# "local" renders SVG charts in-process and serves them from /charts, "remote" posts to CHART_URL
+CHART_RENDERER = os.getenv('CHART_RENDERER', 'remote' if CHART_URL else 'local').lower()
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', 'http://localhost:8000').rstrip('/')
+VECTOR_STORE_PATH = os.getenv('VECTOR_STORE_PATH', 'Vector_store/new_alfred')
+VECTOR_INDEX_NAME = os.getenv('VECTOR_INDEX_NAME', 'faiss.index')
+# flat, ivf, hnsw or pq; non-flat types must have been exported by store.py --index-type
+FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat')
+FAISS_MMAP = os.getenv('FAISS_MMAP', 'true').lower() == 'true'
+SEMANTIC_CACHE_ENABLED = os.getenv('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.95'))
+SEMANTIC_CACHE_TTL = float(os.getenv('SEMANTIC_CACHE_TTL', '3600'))
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', '1000'))
+
+# Repeated contact lookups within a conversation are answered locally for this many seconds
+CONTACTS_CACHE_TTL = float(os.getenv('CONTACTS_CACHE_TTL', '300'))
+CONTACTS_CACHE_SIZE = int(os.getenv('CONTACTS_CACHE_SIZE', '512'))
+# "chain" answers with a nested LLM call, "direct" hands the retrieved chunks straight to the assistant
+RETRIEVER_MODE = os.getenv('RETRIEVER_MODE', 'chain').lower()
+RETRIEVER_K = int(os.getenv('RETRIEVER_K', '4'))
+SOURCE_SNIPPET_LENGTH = int(os.getenv('SOURCE_SNIPPET_LENGTH', '1000'))
+# Fuse BM25 keyword hits with the dense results when store.py has written a BM25 index
+HYBRID_SEARCH = os.getenv('HYBRID_SEARCH', 'true').lower() == 'true'
+HYBRID_DENSE_WEIGHT = float(os.getenv('HYBRID_DENSE_WEIGHT', '1.0'))
+HYBRID_SPARSE_WEIGHT = float(os.getenv('HYBRID_SPARSE_WEIGHT', '1.0'))
+RETRIEVER_FETCH_K = int(os.getenv('RETRIEVER_FETCH_K', '20'))
+RRF_K = int(os.getenv('RRF_K', '60'))
+# Retrieved chunks are deduplicated, merged and trimmed to this many prompt tokens
+CONTEXT_PACKING = os.getenv('CONTEXT_PACKING', 'true').lower() == 'true'
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))
+CONTEXT_MMR = os.getenv('CONTEXT_MMR', 'false').lower() == 'true'
+CONTEXT_MMR_DIVERSITY = float(os.getenv('CONTEXT_MMR_DIVERSITY', '0.3'))
+RAG_PROMPT_FROM_HUB = os.getenv('RAG_PROMPT_FROM_HUB', 'true').lower() == 'true'
+
+# Bundled copy of "langchain-ai/retrieval-qa-chat", used when the hub is unreachable
+LOCAL_RAG_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", "Answer any use questions based solely on the context below:\n\n<context>\n{context}\n</context>"),
+        ("placeholder", "{chat_history}"),
+        ("human", "{input}"),
+    ]
 )
 
-prompt = hub.pull("langchain-ai/retrieval-qa-chat")
+# The heavy resources below are created on first use (or by warmup() at startup), not at import
+_init_lock = threading.RLock()
+_ready = threading.Event()
 
-llm = ChatOpenAI(model_name='gpt-4o-2024-08-06', temperature=0)
 
-combine_docs_chain = create_stuff_documents_chain(llm, prompt)
-rag_chain = create_retrieval_chain(vectorstore.as_retriever(), combine_docs_chain)
+def lazy(func):
+    """Cache a zero-argument factory; concurrent first calls build the resource only once."""
+    result = []
 
+    @functools.wraps(func)
+    def wrapper():
+        if not result:
+            with _init_lock:
+                if not result:
+                    result.append(func())
+        return result[0]
 
+    return wrapper
 
-@tool
+
+@lazy
+def get_embeddings():
+    return CachedEmbeddings(OpenAIEmbeddings())
+
+
+@lazy
+def get_vectorstore():
+    return load_vector_store(
+        folder_path=VECTOR_STORE_PATH,
+        index_name=VECTOR_INDEX_NAME,
+        embeddings=get_embeddings(),
+        index_type=FAISS_INDEX_TYPE,
+        mmap=FAISS_MMAP
+    )
+
+
+@lazy
+def get_retriever():
+    bm25_path = os.path.join(VECTOR_STORE_PATH, f"{VECTOR_INDEX_NAME}.bm25.pkl")
+    if not HYBRID_SEARCH or not os.path.exists(bm25_path):
+        return get_vectorstore().as_retriever(search_kwargs={"k": RETRIEVER_K})
+
+    return HybridRetriever(
+        vectorstore=get_vectorstore(),
+        bm25=BM25Index.load(bm25_path),
+        k=RETRIEVER_K,
+        fetch_k=RETRIEVER_FETCH_K,
+        dense_weight=HYBRID_DENSE_WEIGHT,
+        sparse_weight=HYBRID_SPARSE_WEIGHT,
+        rrf_k=RRF_K,
+    )
+
+
+@lazy
+def get_context_retriever():
+    if not CONTEXT_PACKING:
+        return get_retriever()
+    return get_retriever() | RunnableLambda(
+        lambda docs: pack_context(docs, CONTEXT_TOKEN_BUDGET, use_mmr=CONTEXT_MMR, diversity=CONTEXT_MMR_DIVERSITY)
+    )
+
+
+def load_rag_prompt():
+    if RAG_PROMPT_FROM_HUB:
+        try:
+            return hub.pull("langchain-ai/retrieval-qa-chat")
+        except Exception as e:
+            print(f"Could not pull the RAG prompt from the hub ({e}), using the bundled copy.")
+    return LOCAL_RAG_PROMPT
+
+
+@lazy
+def get_llm():
+    return ChatOpenAI(model_name='gpt-4o-2024-08-06', temperature=0, cache=get_llm_cache())
+
+
+@lazy
+def get_rag_chain():
+    combine_docs_chain = create_stuff_documents_chain(get_llm(), load_rag_prompt())
+    return create_retrieval_chain(get_context_retriever(), combine_docs_chain)
+
+
+@lazy
+def get_answer_cache():
+    # Near-duplicate questions are answered from here instead of re-running the RAG chain
+    return SemanticCache(
+        get_embeddings(),
+        index_path=VECTOR_STORE_PATH,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        ttl=SEMANTIC_CACHE_TTL,
+        maxsize=SEMANTIC_CACHE_SIZE,
+    )
+
+
+contacts_cache = TTLCache(maxsize=CONTACTS_CACHE_SIZE, ttl=CONTACTS_CACHE_TTL)
+contacts_cache_stats = {"hits": 0, "misses": 0}
+
+
+def warmup() -> bool:
+    """Load the index and build the clients and chains so the first request doesn't pay for it.
+
+    Returns whether everything loaded; a failed warmup can simply be retried.
+    """
+    try:
+        get_rag_chain()
+        if SEMANTIC_CACHE_ENABLED:
+            get_answer_cache()
+    except Exception as e:
+        print(f"Error warming up retriever resources: {e}")
+        return False
+    _ready.set()
+    print("Retriever resources loaded.")
+    return True
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+
+def serialize_sources(docs):
+    """Describe retrieved chunks with the source schema returned to the client:
+    id, source path, page (None when unknown) and a snippet of the chunk text."""
+    sources = []
+    for doc in docs:
+        source = doc.metadata.get("source")
+        page = doc.metadata.get("page")
+        sources.append({
+            "id": doc.id or hashlib.sha1(f"{source}:{page}:{doc.page_content}".encode("utf-8")).hexdigest()[:16],
+            "source": source,
+            "page": page,
+            "snippet": doc.page_content[:SOURCE_SNIPPET_LENGTH],
+        })
+    return sources
+
+
+@tool(response_format="content_and_artifact")
 def retriever_tool(query: str = None):
     """This tool contains all the necessary data about
        your company data that can be used to answer questions
@@ -39,14 +213,55 @@ def retriever_tool(query: str = None):
        information and answer their question. Be sure to include the source provided in the JSON format with your answer,
        as the source is essential for accuracy.
     """
-    llm_response = rag_chain.invoke({"input": query})
-    response = repair_json(str(llm_response))
+    if SEMANTIC_CACHE_ENABLED:
+        answer_cache = get_answer_cache()
+        query_vector = answer_cache.embed(query)
+        query_terms = code_terms(query)
+        cached = answer_cache.lookup(query_vector, query_terms)
+        if cached is not None:
+            return cached
+
+    # The sources travel as the tool artifact; only the content is shown to the assistant
+    if RETRIEVER_MODE == "direct":
+        docs = get_context_retriever().invoke(query)
+        content = json.dumps([{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs])
+    else:
+        llm_response = get_rag_chain().invoke({"input": query})
+        docs = llm_response["context"]
+        content = llm_response["answer"]
+
+    response = (content, serialize_sources(docs))
+
+    if SEMANTIC_CACHE_ENABLED:
+        answer_cache.update(query_vector, response, query_terms)
 
     return response
 
 
+def normalize_params(params: dict) -> tuple:
+    return tuple(sorted(
+        (key, str(value).strip().lower()) for key, value in (params or {}).items() if value not in (None, '')
+    ))
+
+
+async def cached_contacts_get(url: str, headers: dict, params: dict = None):
+    """GET a contacts API resource, served from the shared TTL cache when possible."""
+    key = (url, normalize_params(params))
+    cached = contacts_cache.get(key)
+    if cached is not None:
+        contacts_cache_stats["hits"] += 1
+        return cached
+
+    contacts_cache_stats["misses"] += 1
+    response = check_upstream(await request("GET", url, headers=headers, params=params))
+    data = response.json()
+    if response.is_success:
+        contacts_cache[key] = data
+    return data
+
+
 @tool
-def list_contacts(search: str = None):
+async def list_contacts(search: str = None):
     """
     List contacts via the Chatbot Api using Bearer token authentication.
 
@@ -63,14 +278,12 @@ def list_contacts(search: str = None):
         "Accept": "application/json"
     }
 
-    url = f"{api_base_url}/contacts?search={search or ''}"
-    response = requests.get(url, headers=headers)
-
-    return response.json()
+    url = f"{api_base_url}/contacts"
+    return await cached_contacts_get(url, headers, params={"search": search or ''})
 
 
 @tool
-def create_contact(first_name: str, email: str, last_name: str = None, phone: str = None):
+async def create_contact(first_name: str, email: str, last_name: str = None, phone: str = None):
     """
     Create a contact via the Chatbot Api using Bearer token authentication.
 
@@ -98,12 +311,16 @@ def create_contact(first_name: str, email: str, last_name: str = None, phone: st
         "phone": phone
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = check_upstream(await request("POST", url, json=payload, headers=headers))
+
+    # Any cached list or search result may now be missing the new contact
+    if response.is_success:
+        contacts_cache.clear()
 
     return response.json()
 
 @tool
-def get_contact_details(contact_id: str):
+async def get_contact_details(contact_id: str):
     """
     Get contact details by ID via the Chatbot Api using Bearer token authentication.
 
@@ -121,13 +338,11 @@ def get_contact_details(contact_id: str):
     }
 
     url = f"{api_base_url}/contacts/{contact_id}"
-    response = requests.get(url, headers=headers)
-
-    return response.json()
+    return await cached_contacts_get(url, headers)
 
 
 @tool
-def find_contact(first_name: str = None, last_name: str = None, email: str = None):
+async def find_contact(first_name: str = None, last_name: str = None, email: str = None):
     """
     Find contact via the Chatbot Api using Bearer token authentication.
 
@@ -156,12 +371,10 @@ def find_contact(first_name: str = None, last_name: str = None, email: str = Non
     if email:
         query_params['email'] = email
 
-    response = requests.get(url, headers=headers, params=query_params)
-
-    return response.json()
+    return await cached_contacts_get(url, headers, params=query_params)
 
 @tool
-def send_email(subject: str, html: str, to: list, cc: list = None, bcc: list = None):
+async def send_email(subject: str, html: str, to: list, cc: list = None, bcc: list = None):
     """
     Send an email via the Chatbot Api using Bearer token authentication.
 
@@ -198,7 +411,7 @@ def send_email(subject: str, html: str, to: list, cc: list = None, bcc: list = N
         "bcc": bcc
     }
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = check_upstream(await request("POST", url, json=payload, headers=headers))
 
     return response.json()
 
@@ -206,7 +419,7 @@ def send_email(subject: str, html: str, to: list, cc: list = None, bcc: list = N
 
 
 @tool
-def generate_chart(chart_type: str, data: dict, title: str = None) -> dict:
+async def generate_chart(chart_type: str, data: dict, title: str = None) -> dict:
     """
     Calls an API to generate a chart (bar, pie, line, or area) based on provided data.
 
@@ -224,6 +437,14 @@ def generate_chart(chart_type: str, data: dict, title: str = None) -> dict:
     Sends the user-provided data as the payload and returns the URL of the generated SVG chart or an error message.
     """
 
+    if CHART_RENDERER == "local":
+        try:
+            key = await asyncio.to_thread(chart_store.render, chart_type, data, title)
+        except (TypeError, ValueError) as e:
+            # Malformed model input, not a service failure
+            return {"error": f"Failed to generate chart: {str(e)}"}
+        return {"url": f"{PUBLIC_BASE_URL}/charts/{key}.svg"}
+
     url = CHART_URL
 
     body_payload = {
@@ -234,11 +455,9 @@ def generate_chart(chart_type: str, data: dict, title: str = None) -> dict:
     if title:
         params["title"] = title
 
-    try:
-        response = requests.post(url, json=body_payload, params=params)
-        if response.status_code == 200:
-            return response.json()  # Assuming the response contains the URL of the SVG chart
-        else:
-            return {"error": f"Failed to generate chart. Status code: {response.status_code}, Message: {response.text}"}
-    except Exception as e:
-        return {"error": f"An error occurred: {str(e)}"}
\ No newline at end of file
+    # Transport errors and 5xx responses propagate so the tool guard counts them against the chart service
+    response = check_upstream(await request("POST", url, json=body_payload, params=params))
+    if response.status_code == 200:
+        return response.json()  # Assuming the response contains the URL of the SVG chart
+    else:
+        return {"error": f"Failed to generate chart. Status code: {response.status_code}, Message: {response.text}"}
\ No newline at end of file
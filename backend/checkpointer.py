@@ -0,0 +1,205 @@
+import copy
+from collections import OrderedDict
+from typing import AsyncIterator, Iterator, Optional
+
+from langgraph.checkpoint.base import BaseCheckpointSaver, CheckpointTuple
+from langgraph.checkpoint.memory import MemorySaver
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+# "memory" keeps the previous single-process behaviour, "postgres" shares state across workers and nodes
+CHECKPOINTER = os.getenv("CHECKPOINTER", "memory").lower()
+CHECKPOINT_CACHE_SIZE = int(os.getenv("CHECKPOINT_CACHE_SIZE", "256"))
+# Opt-in cap for the in-memory saver; threads beyond it lose their history, 0 keeps every thread
+CHECKPOINT_MAX_THREADS = int(os.getenv("CHECKPOINT_MAX_THREADS", "0"))
+CHECKPOINT_POOL_SIZE = int(os.getenv("CHECKPOINT_POOL_SIZE", "10"))
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+def _thread_key(config) -> tuple:
+    configurable = config["configurable"]
+    return configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+
+class BoundedMemorySaver(MemorySaver):
+    """MemorySaver that forgets the least recently used threads beyond `max_threads`.
+
+    The memory saver holds the only copy of a thread's state, so an evicted thread continues
+    without its history. Only used when CHECKPOINT_MAX_THREADS is set.
+    """
+
+    def __init__(self, max_threads: int = CHECKPOINT_MAX_THREADS, **kwargs):
+        super().__init__(**kwargs)
+        self.max_threads = max_threads
+        self._recent = OrderedDict()
+
+    def _touch(self, thread_id: str):
+        self._recent[thread_id] = None
+        self._recent.move_to_end(thread_id)
+
+        while len(self._recent) > self.max_threads:
+            evicted, _ = self._recent.popitem(last=False)
+            self.storage.pop(evicted, None)
+            for key in [key for key in self.writes if key[0] == evicted]:
+                del self.writes[key]
+
+    def get_tuple(self, config) -> Optional[CheckpointTuple]:
+        result = super().get_tuple(config)
+        if result is not None:
+            self._touch(config["configurable"]["thread_id"])
+        return result
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        self._touch(config["configurable"]["thread_id"])
+        return next_config
+
+
+class CachedCheckpointSaver(BaseCheckpointSaver):
+    """Keeps the latest checkpoint of hot threads in an in-process LRU in front of a shared saver.
+
+    Every cache hit is validated against the latest checkpoint id in Postgres with a single
+    indexed lookup, so a turn handled by another worker is never served stale state; only the
+    expensive blob and pending-write loading is skipped.
+
+    The graph mutates the checkpoint it is given in place, so the cache only ever hands out and
+    stores deep copies; a failed write can't leave a mutated checkpoint behind under an old id.
+    """
+
+    def __init__(self, saver: BaseCheckpointSaver, pool, maxsize: int = CHECKPOINT_CACHE_SIZE):
+        super().__init__(serde=saver.serde)
+        self.saver = saver
+        self.pool = pool
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    @property
+    def config_specs(self):
+        return self.saver.config_specs
+
+    def _remember(self, key: tuple, checkpoint_tuple: CheckpointTuple):
+        self._cache[key] = checkpoint_tuple
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    async def _latest_checkpoint_id(self, thread_id: str, checkpoint_ns: str) -> Optional[str]:
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = %s AND checkpoint_ns = %s "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                )
+                row = await cur.fetchone()
+        return row["checkpoint_id"] if row else None
+
+    async def aget_tuple(self, config) -> Optional[CheckpointTuple]:
+        # Explicit checkpoint ids (time travel, history) always go to the database
+        if config["configurable"].get("checkpoint_id"):
+            return await self.saver.aget_tuple(config)
+
+        key = _thread_key(config)
+        cached = self._cache.get(key)
+        if cached is not None:
+            latest_id = await self._latest_checkpoint_id(*key)
+            if latest_id == cached.config["configurable"]["checkpoint_id"]:
+                self._cache.move_to_end(key)
+                return copy.deepcopy(cached)
+            del self._cache[key]
+
+        result = await self.saver.aget_tuple(config)
+        if result is not None:
+            self._remember(key, copy.deepcopy(result))
+        return result
+
+    async def alist(self, config, *, filter=None, before=None, limit=None) -> AsyncIterator[CheckpointTuple]:
+        async for item in self.saver.alist(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        next_config = await self.saver.aput(config, checkpoint, metadata, new_versions)
+        parent_config = config if config["configurable"].get("checkpoint_id") else None
+        self._remember(
+            _thread_key(next_config),
+            CheckpointTuple(
+                config=next_config,
+                checkpoint=copy.deepcopy(checkpoint),
+                metadata=copy.deepcopy(metadata),
+                parent_config=parent_config,
+                pending_writes=[],
+            ),
+        )
+        return next_config
+
+    async def aput_writes(self, config, writes, task_id: str, *args) -> None:
+        await self.saver.aput_writes(config, writes, task_id, *args)
+
+        key = _thread_key(config)
+        cached = self._cache.get(key)
+        if cached is None:
+            return
+        if cached.config["configurable"]["checkpoint_id"] != config["configurable"].get("checkpoint_id"):
+            del self._cache[key]
+            return
+        cached.pending_writes.extend((task_id, channel, copy.deepcopy(value)) for channel, value in writes)
+
+    def get_next_version(self, current, channel):
+        return self.saver.get_next_version(current, channel)
+
+    # The graph only runs through the async API; the sync methods delegate without caching.
+    def get_tuple(self, config) -> Optional[CheckpointTuple]:
+        return self.saver.get_tuple(config)
+
+    def list(self, config, *, filter=None, before=None, limit=None) -> Iterator[CheckpointTuple]:
+        return self.saver.list(config, filter=filter, before=before, limit=limit)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self.saver.put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id: str, *args) -> None:
+        return self.saver.put_writes(config, writes, task_id, *args)
+
+
+def _psycopg_url(url: str) -> str:
+    # DATABASE_URL is written for SQLAlchemy+asyncpg; psycopg wants a plain libpq URL
+    return url.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+
+checkpoint_pool = None
+
+
+def create_checkpointer():
+    global checkpoint_pool
+
+    if CHECKPOINTER != "postgres":
+        if CHECKPOINT_MAX_THREADS > 0:
+            return BoundedMemorySaver(CHECKPOINT_MAX_THREADS)
+        return MemorySaver()
+
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+
+    checkpoint_pool = AsyncConnectionPool(
+        conninfo=_psycopg_url(DATABASE_URL),
+        max_size=CHECKPOINT_POOL_SIZE,
+        kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+        open=False,
+    )
+    return CachedCheckpointSaver(AsyncPostgresSaver(checkpoint_pool), checkpoint_pool)
+
+
+async def open_checkpointer(checkpointer):
+    """Open the connection pool and create the checkpoint tables; call once at startup."""
+    if checkpoint_pool is None:
+        return
+    await checkpoint_pool.open()
+    await checkpointer.saver.setup()
+
+
+async def close_checkpointer():
+    if checkpoint_pool is not None:
+        await checkpoint_pool.close()
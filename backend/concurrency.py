@@ -0,0 +1,115 @@
+import asyncio
+from contextlib import AsyncExitStack, asynccontextmanager
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+MAX_CONCURRENT_RUNS = int(os.getenv("MAX_CONCURRENT_RUNS", "8"))
+MAX_QUEUED_RUNS = int(os.getenv("MAX_QUEUED_RUNS", "32"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "30"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "5"))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a run can't be admitted; `status_code` is 429 (queue full) or 503 (timed out waiting)."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int = RETRY_AFTER_SECONDS):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Caps how many agent runs execute at once, with a bounded queue of runs waiting for a slot."""
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_RUNS, max_queued: int = MAX_QUEUED_RUNS,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+
+    async def acquire(self, bounded: bool = True):
+        """Wait for a slot and return a function that gives it back; calling it twice is harmless.
+
+        Unbounded callers (background jobs, which already wait in their own queue) wait as long as it
+        takes instead of counting against the request queue.
+        """
+        if bounded and self._slots.locked():
+            if self._waiting >= self.max_queued:
+                raise AdmissionRejected(429, "Too many requests are waiting, please retry shortly.")
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise AdmissionRejected(503, "The assistant is busy, please retry shortly.")
+            finally:
+                self._waiting -= 1
+        else:
+            await self._slots.acquire()
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self._slots.release()
+
+        return release
+
+    @asynccontextmanager
+    async def slot(self, bounded: bool = True):
+        release = await self.acquire(bounded)
+        try:
+            yield
+        finally:
+            release()
+
+
+class ThreadLocks:
+    """One asyncio.Lock per thread id so turns of the same conversation run one at a time.
+
+    Locks are dropped as soon as nobody holds or waits for them, so the map doesn't grow with
+    the number of threads ever seen.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._users = {}
+
+    @asynccontextmanager
+    async def hold(self, thread_id):
+        lock = self._locks.setdefault(thread_id, asyncio.Lock())
+        self._users[thread_id] = self._users.get(thread_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[thread_id] -= 1
+            if not self._users[thread_id]:
+                del self._users[thread_id]
+                del self._locks[thread_id]
+
+
+admission = AdmissionController()
+thread_locks = ThreadLocks()
+
+
+@asynccontextmanager
+async def turn_slot(thread_id, bounded: bool = True):
+    """Take the thread's lock first and only then an admission slot, so a turn queued behind
+    another turn of the same thread doesn't hold a global slot while it waits."""
+    async with thread_locks.hold(thread_id):
+        async with admission.slot(bounded):
+            yield
+
+
+async def acquire_turn(thread_id, bounded: bool = True):
+    """turn_slot for responses that outlive the handler; returns an async release function that is
+    safe to call more than once."""
+    stack = AsyncExitStack()
+    await stack.enter_async_context(turn_slot(thread_id, bounded))
+    return stack.aclose
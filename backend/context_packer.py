@@ -0,0 +1,126 @@
+from functools import lru_cache
+from typing import List
+
+from langchain_core.documents import Document
+
+from hybrid_search import tokenize
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        # Rough rule of thumb for English text when tiktoken isn't available
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+def _overlap(left: str, right: str, max_overlap: int = 400) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`."""
+    for size in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def deduplicate(docs: List[Document]) -> List[Document]:
+    """Drop chunks whose text is identical to, or contained in, a better ranked chunk."""
+    kept, seen = [], []
+    for doc in docs:
+        text = _normalize(doc.page_content)
+        if not text or any(text in other for other in seen):
+            continue
+        kept.append(doc)
+        seen.append(text)
+    return kept
+
+
+def merge_adjacent(docs: List[Document]) -> List[Document]:
+    """Join consecutive chunks of the same page into one passage, removing the splitter's overlap.
+
+    A merged passage takes the rank of its best ranked part.
+    """
+    groups = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        groups.setdefault(key, []).append((rank, doc))
+
+    passages = []
+    for parts in groups.values():
+        parts.sort(key=lambda part: (part[1].metadata.get("chunk") is None, part[1].metadata.get("chunk", 0)))
+        run_rank, run = parts[0][0], [parts[0][1]]
+
+        for rank, doc in parts[1:]:
+            previous = run[-1].metadata.get("chunk")
+            current = doc.metadata.get("chunk")
+            if previous is not None and current == previous + 1:
+                run.append(doc)
+                run_rank = min(run_rank, rank)
+            else:
+                passages.append((run_rank, run))
+                run_rank, run = rank, [doc]
+        passages.append((run_rank, run))
+
+    merged = []
+    for rank, run in sorted(passages, key=lambda passage: passage[0]):
+        text = run[0].page_content
+        for doc in run[1:]:
+            text += doc.page_content[_overlap(text, doc.page_content):]
+        merged.append(Document(id=run[0].id, page_content=text, metadata=run[0].metadata))
+    return merged
+
+
+def mmr(docs: List[Document], diversity: float = 0.3) -> List[Document]:
+    """Reorder by maximal marginal relevance, using retrieval rank as relevance and term overlap
+    (Jaccard) as similarity, so near-duplicate passages sink below new information."""
+    if not docs:
+        return docs
+
+    terms = [set(tokenize(doc.page_content)) for doc in docs]
+    relevance = [1 - rank / len(docs) for rank in range(len(docs))]
+    remaining = list(range(len(docs)))
+    selected = []
+
+    while remaining:
+        def score(i):
+            similarity = max(
+                (len(terms[i] & terms[j]) / (len(terms[i] | terms[j]) or 1) for j in selected),
+                default=0.0,
+            )
+            return (1 - diversity) * relevance[i] - diversity * similarity
+
+        best = max(remaining, key=score)
+        selected.append(best)
+        remaining.remove(best)
+
+    return [docs[i] for i in selected]
+
+
+def pack_context(docs: List[Document], token_budget: int, use_mmr: bool = False,
+                 diversity: float = 0.3) -> List[Document]:
+    """Deduplicate, merge and optionally diversify retrieved chunks, then keep as many as fit
+    into `token_budget` tokens in rank order."""
+    passages = merge_adjacent(deduplicate(docs))
+    if use_mmr:
+        passages = mmr(passages, diversity)
+
+    packed, used = [], 0
+    for passage in passages:
+        tokens = count_tokens(passage.page_content)
+        if used + tokens > token_budget:
+            continue
+        packed.append(passage)
+        used += tokens
+    return packed
@@ -0,0 +1,83 @@
+import asyncio
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+
+# Only idempotent requests are retried after the request may have reached the server
+RETRY_METHODS = {"GET", "HEAD", "OPTIONS"}
+RETRY_STATUS_CODES = {502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """An upstream service answered with a server error."""
+
+
+def check_upstream(response: httpx.Response) -> httpx.Response:
+    """Raise UpstreamError for a 5xx response; client errors are left to the caller."""
+    if response.status_code >= 500:
+        raise UpstreamError(f"{response.request.method} {response.request.url} returned {response.status_code}: "
+                            f"{response.text[:200]}")
+    return response
+
+
+_client = None
+_host_limits = defaultdict(lambda: asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST))
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            # Connection failures are always safe to retry, the request never left this process.
+            # The pool limits go on the transport: the client ignores its own when given one.
+            transport=httpx.AsyncHTTPTransport(
+                retries=HTTP_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                ),
+            ),
+        )
+    return _client
+
+
+async def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Send a request through the shared client with a per-host connection cap and retries."""
+    method = method.upper()
+    attempts = HTTP_RETRIES + 1 if method in RETRY_METHODS else 1
+
+    async with _host_limits[urlsplit(url).netloc]:
+        for attempt in range(attempts):
+            try:
+                response = await get_client().request(method, url, **kwargs)
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                if attempt == attempts - 1:
+                    raise
+                print(f"{method} {url} failed ({e!r}), retrying")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == attempts - 1:
+                    return response
+                print(f"{method} {url} returned {response.status_code}, retrying")
+
+            await asyncio.sleep(HTTP_RETRY_BACKOFF * 2 ** attempt)
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,120 @@
+import math
+import pickle
+import re
+from collections import Counter, defaultdict
+from typing import List, Optional
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+# Keeps product names and test codes such as "astm-d6927" or "ss-1h" together as single terms
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Minimal in-memory inverted index scored with Okapi BM25."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.doc_lengths = []
+        self.postings = defaultdict(list)
+        self.idf = {}
+        self.avgdl = 0.0
+
+    @classmethod
+    def build(cls, ids: List[str], texts: List[str], **kwargs) -> "BM25Index":
+        index = cls(**kwargs)
+        for position, (doc_id, text) in enumerate(zip(ids, texts)):
+            terms = Counter(tokenize(text))
+            index.ids.append(doc_id)
+            index.doc_lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                index.postings[term].append((position, frequency))
+
+        count = len(index.ids)
+        index.avgdl = sum(index.doc_lengths) / count if count else 0.0
+        index.idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in index.postings.items()
+        }
+        index.postings = dict(index.postings)
+        return index
+
+    def search(self, query: str, k: int) -> List[tuple]:
+        """Return up to k (doc_id, score) pairs, best first."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for position, frequency in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / self.avgdl)
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[position], score) for position, score in best]
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: str) -> "BM25Index":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], weights: List[float], rrf_k: int = 60) -> List[str]:
+    """Fuse ranked id lists; each id scores sum(weight / (rrf_k + rank)) over the lists it appears in."""
+    scores = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += weight / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """Dense FAISS search and BM25 keyword search combined with reciprocal rank fusion."""
+
+    vectorstore: FAISS
+    bm25: Optional[BM25Index] = None
+    k: int = 4
+    fetch_k: int = 20
+    dense_weight: float = 1.0
+    sparse_weight: float = 1.0
+    rrf_k: int = 60
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _dense_ids(self, query: str) -> List[str]:
+        vector = np.array([self.vectorstore._embed_query(query)], dtype=np.float32)
+        _, positions = self.vectorstore.index.search(vector, self.fetch_k)
+        return [self.vectorstore.index_to_docstore_id[position] for position in positions[0] if position != -1]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        rankings = [self._dense_ids(query)]
+        weights = [self.dense_weight]
+        if self.bm25 is not None:
+            rankings.append([doc_id for doc_id, _ in self.bm25.search(query, self.fetch_k)])
+            weights.append(self.sparse_weight)
+
+        documents = []
+        for doc_id in reciprocal_rank_fusion(rankings, weights, self.rrf_k):
+            doc = self.vectorstore.docstore.search(doc_id)
+            # The docstore answers unknown ids with a message string rather than raising
+            if not isinstance(doc, Document):
+                continue
+            documents.append(Document(id=doc_id, page_content=doc.page_content, metadata=doc.metadata))
+            if len(documents) == self.k:
+                break
+        return documents
@@ -0,0 +1,186 @@
+import asyncio
+import importlib
+from abc import ABC, abstractmethod
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RESULTS_KEPT = int(os.getenv("JOB_RESULTS_KEPT", "1000"))
+# "module:ClassName" of a JobBackend, e.g. a Redis or Postgres implementation shared by several nodes
+JOB_BACKEND = os.getenv("JOB_BACKEND", "")
+
+FINISHED_STATUSES = {"succeeded", "failed"}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobBackend(ABC):
+    """Queue and status store used by JobManager.
+
+    The in-memory backend below serves a single process; a backend backed by Redis or Postgres can
+    implement the same methods to share the queue, records and events across nodes.
+    """
+
+    @abstractmethod
+    async def enqueue(self, job: dict) -> None:
+        """Add a job to the queue or raise JobQueueFull."""
+
+    @abstractmethod
+    async def dequeue(self) -> dict:
+        """Wait for and return the next job."""
+
+    @abstractmethod
+    async def save(self, record: dict) -> None:
+        ...
+
+    @abstractmethod
+    async def load(self, job_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def publish(self, job_id: str, record: dict) -> None:
+        """Deliver a record update to everyone subscribed to the job."""
+
+    @abstractmethod
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        ...
+
+    @abstractmethod
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        ...
+
+
+class InMemoryJobBackend(JobBackend):
+    def __init__(self, queue_size: int = JOB_QUEUE_SIZE, results_kept: int = JOB_RESULTS_KEPT):
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._records = OrderedDict()
+        self._subscribers = {}
+        self.results_kept = results_kept
+
+    async def enqueue(self, job: dict) -> None:
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull("The job queue is full.")
+
+    async def dequeue(self) -> dict:
+        return await self._queue.get()
+
+    async def save(self, record: dict) -> None:
+        self._records[record["job_id"]] = record
+        self._records.move_to_end(record["job_id"])
+
+        # Forget the oldest finished jobs once too many results are kept around
+        excess = len(self._records) - self.results_kept
+        for job_id in [job_id for job_id, kept in self._records.items() if kept["status"] in FINISHED_STATUSES][:max(excess, 0)]:
+            del self._records[job_id]
+
+    async def load(self, job_id: str) -> Optional[dict]:
+        return self._records.get(job_id)
+
+    async def publish(self, job_id: str, record: dict) -> None:
+        for queue in self._subscribers.get(job_id, []):
+            queue.put_nowait(record)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(job_id, [])
+        if queue in queues:
+            queues.remove(queue)
+        if not queues:
+            self._subscribers.pop(job_id, None)
+
+
+def load_backend() -> JobBackend:
+    if not JOB_BACKEND:
+        return InMemoryJobBackend()
+    module_name, class_name = JOB_BACKEND.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class JobManager:
+    """Runs submitted jobs on a pool of asyncio worker tasks; `runner(**payload)` does the work."""
+
+    def __init__(self, runner: Callable[..., Awaitable[dict]], backend: JobBackend = None, workers: int = JOB_WORKERS):
+        self.runner = runner
+        self.backend = backend or load_backend()
+        self.workers = workers
+        self._tasks = []
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, payload: dict) -> dict:
+        record = {
+            "job_id": str(uuid.uuid4()),
+            "status": "queued",
+            "created_at": time.time(),
+            "result": None,
+            "error": None,
+        }
+        await self.backend.save(record)
+        try:
+            await self.backend.enqueue({"job_id": record["job_id"], "payload": payload})
+        except JobQueueFull:
+            record["status"] = "failed"
+            record["error"] = "The job queue is full."
+            await self.backend.save(record)
+            raise
+        return record
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.backend.load(job_id)
+
+    async def _update(self, record: dict, **changes):
+        record = {**record, **changes}
+        await self.backend.save(record)
+        await self.backend.publish(record["job_id"], record)
+        return record
+
+    async def _work(self):
+        while True:
+            job = await self.backend.dequeue()
+            record = await self.backend.load(job["job_id"]) or {"job_id": job["job_id"]}
+            record = await self._update(record, status="running", started_at=time.time())
+            try:
+                result = await self.runner(**job["payload"])
+                await self._update(record, status="succeeded", result=result, finished_at=time.time())
+            except asyncio.CancelledError:
+                await self._update(record, status="failed", error="Worker stopped.", finished_at=time.time())
+                raise
+            except Exception as e:
+                print(f"Job {job['job_id']} failed: {e}")
+                await self._update(record, status="failed", error=str(e), finished_at=time.time())
+
+    async def events(self, job_id: str):
+        """Yield the job record now and on every change until the job finishes."""
+        queue = self.backend.subscribe(job_id)
+        try:
+            record = await self.backend.load(job_id)
+            if record is None:
+                return
+            yield record
+            while record["status"] not in FINISHED_STATUSES:
+                record = await queue.get()
+                yield record
+        finally:
+            self.backend.unsubscribe(job_id, queue)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.load import dumps, loads
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "cache/llm.sqlite")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+# Tools whose calls change something outside the conversation; a replayed completion must never
+# trigger them again, so any exchange that involves them goes to the model
+SIDE_EFFECT_TOOLS = {"send_email", "create_contact"}
+
+
+def _called_tools(value) -> set:
+    """Names of the tools called anywhere in a serialized message list."""
+    names = set()
+    if isinstance(value, dict):
+        for call in value.get("tool_calls") or []:
+            if isinstance(call, dict):
+                names.add(call.get("name") or (call.get("function") or {}).get("name"))
+        for child in value.values():
+            names |= _called_tools(child)
+    elif isinstance(value, list):
+        for child in value:
+            names |= _called_tools(child)
+    return names
+
+
+def _has_side_effects(prompt: str) -> bool:
+    try:
+        return bool(_called_tools(json.loads(prompt)) & SIDE_EFFECT_TOOLS)
+    except ValueError:
+        return False
+
+
+class SQLiteLLMCache(BaseCache):
+    """Exact-match cache of completions in SQLite, keyed by a hash of (model and bound tools, messages).
+
+    Only meant for deterministic (temperature 0) models. Keeps at most `max_entries` completions,
+    evicting the least recently used ones.
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions "
+            "(key TEXT PRIMARY KEY, generations TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_completions_last_used ON completions (last_used)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        # llm_string carries the model name, its parameters and the bound tool schemas
+        return hashlib.sha256(f"{llm_string}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if _has_side_effects(prompt):
+            return None
+
+        key = self._key(prompt, llm_string)
+        with self._lock:
+            row = self._conn.execute("SELECT generations FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE completions SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+
+        try:
+            return [loads(generation) for generation in json.loads(row[0])]
+        except Exception as e:
+            print(f"Dropping unreadable LLM cache entry: {e}")
+            with self._lock:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._conn.commit()
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        if _has_side_effects(prompt):
+            return
+        for generation in return_val:
+            message = getattr(generation, "message", None)
+            if {call["name"] for call in getattr(message, "tool_calls", None) or []} & SIDE_EFFECT_TOOLS:
+                return
+
+        generations = json.dumps([dumps(generation) for generation in return_val])
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, generations, last_used) VALUES (?, ?, ?)",
+                (self._key(prompt, llm_string), generations, time.time()),
+            )
+            self._conn.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "size": size, "max_entries": self.max_entries}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[SQLiteLLMCache]:
+    """The shared cache for temperature-0 models, or None when LLM_CACHE_ENABLED is off."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SQLiteLLMCache()
+        return _cache
@@ -1,5 +1,9 @@
-from fastapi import FastAPI, Depends, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse, Response
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
+from typing import Optional
+from datetime import datetime
 import logging
 import re
 import json
@@ -7,10 +11,18 @@ from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, String, Text, JSON, ForeignKey, Integer
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy import text
-from assistant import agent
+from sqlalchemy import Column, String, Text, JSON, ForeignKey, Integer, Index, DateTime, func
+from sqlalchemy.dialects.postgresql import UUID, insert as pg_insert
+from sqlalchemy import text, insert
+from assistant import agent, memory
+from checkpointer import open_checkpointer, close_checkpointer
+from http_client import close_client
+import chatbot_tools
+from concurrency import AdmissionRejected, acquire_turn, turn_slot, RETRY_AFTER_SECONDS
+from jobs import JobManager, JobQueueFull
+from charts import chart_store
+from contextlib import asynccontextmanager
+import asyncio
 import uuid
 import os
 from dotenv import load_dotenv
@@ -18,6 +30,15 @@ from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Write a turn's messages after the response has been returned instead of before it
+PERSIST_IN_BACKGROUND = os.getenv("PERSIST_IN_BACKGROUND", "false").lower() == "true"
+MESSAGES_PAGE_SIZE = int(os.getenv("MESSAGES_PAGE_SIZE", "100"))
+MESSAGES_MAX_PAGE_SIZE = int(os.getenv("MESSAGES_MAX_PAGE_SIZE", "500"))
+THREADS_PAGE_SIZE = int(os.getenv("THREADS_PAGE_SIZE", "50"))
+THREADS_MAX_PAGE_SIZE = int(os.getenv("THREADS_MAX_PAGE_SIZE", "200"))
+THREAD_PREVIEW_LENGTH = int(os.getenv("THREAD_PREVIEW_LENGTH", "120"))
+WARMUP_RETRY_BACKOFF = float(os.getenv("WARMUP_RETRY_BACKOFF", "2"))
+WARMUP_MAX_RETRY_DELAY = float(os.getenv("WARMUP_MAX_RETRY_DELAY", "60"))
 print(DATABASE_URL)
 
 engine = create_async_engine(DATABASE_URL, echo=True)
@@ -38,13 +59,42 @@ class MessageModel(Base):
     message_content = Column(Text, nullable=False)
     response_metadata = Column(JSON)
 
+    __table_args__ = (Index("ix_messages_thread_id_id", "thread_id", "id"),)
+
 class ThreadModel(Base):
     __tablename__ = "threads"
     thread_id = Column(UUID(as_uuid=True), primary_key=True)
     name = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    last_message_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (Index("ix_threads_last_message_at", "last_message_at", "thread_id"),)
+
+
+async def warm_up():
+    """Warm up the retriever resources, retrying with backoff until they load so /ready recovers
+    from a transient failure instead of keeping the worker out of rotation."""
+    delay = WARMUP_RETRY_BACKOFF
+    while not await asyncio.to_thread(chatbot_tools.warmup):
+        print(f"Retrying warmup in {delay:g} seconds.")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WARMUP_MAX_RETRY_DELAY)
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_checkpointer(memory)
+    # Load the index and clients in the background; /ready reports when they are available
+    warmup_task = run_in_background(warm_up())
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    warmup_task.cancel()
+    await close_client()
+    await close_checkpointer()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -56,6 +106,9 @@ app.add_middleware(
 
 class ThreadRequest(BaseModel):
     thread_id: uuid.UUID
+    # Keyset cursor: return messages older than this id, newest page first when omitted
+    before_id: Optional[int] = None
+    limit: int = Field(default=MESSAGES_PAGE_SIZE, ge=1, le=MESSAGES_MAX_PAGE_SIZE)
 
 
 class UserInput(BaseModel):
@@ -76,6 +129,10 @@ class ThreadCreate(BaseModel):
 class ListThreads(BaseModel):
     thread_id: uuid.UUID
     name: str
+    created_at: Optional[datetime] = None
+    last_message_at: Optional[datetime] = None
+    message_count: int = 0
+    last_message: Optional[str] = None
 
 class MessageListResponse(BaseModel):
     id: int
@@ -94,37 +151,44 @@ class UpdateThreadRequest(BaseModel):
 
 
 
-async def save_message_to_db(message: MessageCreate):
-    print(f'The save message for db: {message}')
-    async with async_session() as session:
-
-        message_entry = MessageModel(
-            thread_id=message.thread_id,
-            role=message.role,
-            message_content=message.message_content,
-            response_metadata=message.response_metadata
-        )
-        session.add(message_entry)
-        await session.commit()
-
-
 async def save_thread_to_db(thread: ThreadCreate):
     async with async_session() as session:
         session.add(ThreadModel(**thread.dict()))
         await session.commit()
 
-async def thread_exists(thread_id: uuid.UUID) -> bool:
+async def save_turn_to_db(thread: ThreadCreate, messages: list[MessageCreate]):
+    """Upsert the thread and insert all of a turn's messages in a single transaction."""
     async with async_session() as session:
-        result = await session.execute(text("SELECT 1 FROM threads WHERE thread_id = :thread_id"), {"thread_id": thread_id})
-        return result.fetchone() is not None
+        async with session.begin():
+            # The upsert also bumps last_message_at, so the sidebar ordering needs no extra statement
+            await session.execute(
+                pg_insert(ThreadModel)
+                .values(thread_id=thread.thread_id, name=thread.name)
+                .on_conflict_do_update(index_elements=["thread_id"], set_={"last_message_at": func.now()})
+            )
+            if messages:
+                await session.execute(insert(MessageModel), [message.dict() for message in messages])
 
-async def delete_thread_from_db(thread_id: uuid.UUID):
-    async with async_session() as session:
-        await session.execute(text("DELETE FROM threads WHERE thread_id = :thread_id"), {"thread_id": thread_id})
-        await session.commit()
+
+background_tasks = set()
+
+
+def run_in_background(coro):
+    # Keep a reference so the task isn't garbage collected before it finishes
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    task.add_done_callback(log_background_failure)
+    return task
+
+
+def log_background_failure(task: asyncio.Task):
+    # Nobody awaits these tasks, so report failures here instead of losing them silently
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background task {task.get_coro().__qualname__} failed: {task.exception()!r}")
 
 
-async def process_ai_messages(messages, thread_id):
+async def process_ai_messages(messages, thread_id, thread_name: str = "new_chat"):
 
     if not messages:
         print(f"No messages found for thread_id: {thread_id}")
@@ -148,15 +212,19 @@ async def process_ai_messages(messages, thread_id):
         last_ai_message = ai_messages[-1] if ai_messages else None
         messages_to_process = [msg for msg in [last_human_message, last_tool_message, last_ai_message] if msg]
 
-    # Process and save the selected messages
-    for message in messages_to_process:
-        print(f"Saving message: {message.content}")
-        await save_message_to_db(MessageCreate(
-            thread_id=thread_id,
-            role=type(message).__name__.replace("Message", ""),
-            message_content=message.content,
-            response_metadata=message.response_metadata
-        ))
+    # Save the thread and the selected messages together
+    await save_turn_to_db(
+        ThreadCreate(thread_id=thread_id, name=thread_name),
+        [
+            MessageCreate(
+                thread_id=thread_id,
+                role=type(message).__name__.replace("Message", ""),
+                message_content=message.content,
+                response_metadata=message.response_metadata
+            )
+            for message in messages_to_process
+        ]
+    )
 
     print(f"Processed messages for thread_id {thread_id}: {[msg.content for msg in messages_to_process]}")
 
@@ -165,68 +233,52 @@ async def process_ai_messages(messages, thread_id):
 
 
 async def process_sources(messages):
+    """Return the sources attached by retriever_tool to the most recent retrieval of the turn."""
     print(f"Total messages received: {len(messages)}")
 
-
     if not messages:
         print("No messages received.")
         return
 
-    tool_message_content = None
-
-
     for message in reversed(messages):
-        message_type = type(message).__name__.replace("Message", "")
-
-        if message_type == "Tool":
-            tool_message_content = message.content
+        if type(message).__name__ == "HumanMessage":
             break
 
+        if type(message).__name__ == "ToolMessage" and message.name == "retriever_tool":
+            sources = message.artifact or []
+            # metadata/page_content keep the shape the frontend already reads
+            return [
+                {
+                    **source,
+                    "metadata": {"source": source["source"], "page": source["page"]},
+                    "page_content": source["snippet"],
+                }
+                for source in sources
+            ]
+
+    print("No retriever_tool message found in this turn.")
+    return
+
+
+async def persist_turn(messages, thread_id: uuid.UUID, thread_name: str):
+    if PERSIST_IN_BACKGROUND:
+        run_in_background(process_ai_messages(messages, thread_id, thread_name))
+    else:
+        await process_ai_messages(messages, thread_id, thread_name)
 
-    if tool_message_content is None:
-        print("No Tool message found in the received messages.")
-        return
-
-    print("Raw tool_message_content:", tool_message_content)
-
-    try:
-
-        docu = json.loads(tool_message_content)
-    except json.JSONDecodeError as e:
-        print(f"JSON decoding error: {e}")
-        return
-
-    documents = docu.get("context", [])
-    document_list = []
-
-
-    for doc_str in documents:
-
-        matches = re.findall(r"metadata=\{(.*?)\}, page_content='(.*?)'", doc_str, re.DOTALL)
-        for metadata_match, page_content_match in matches:
-            metadata_str = f"{{{metadata_match}}}"
-            try:
-
-                metadata_dict = eval(metadata_str)
-                document_list.append({
-                    'metadata': metadata_dict,
-                    'page_content': page_content_match
-                })
-            except Exception as e:
-                print(f"Error converting metadata to dict: {e}")
-
-    print(document_list)
-    return document_list
 
+def admission_error(error: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=error.status_code, detail=error.detail,
+                         headers={"Retry-After": str(error.retry_after)})
 
-async def run_ai_thread(user_input: str, thread_id: uuid.UUID, thread_name: str):
-    if not await thread_exists(thread_id):
-        await save_thread_to_db(ThreadCreate(thread_id=thread_id, name=thread_name))
 
-    res = await agent.ainvoke({"messages": [("human", user_input)]},
-                              config={"configurable": {"thread_id": str(thread_id), "thread_name": thread_name}})
+async def run_ai_thread(user_input: str, thread_id: uuid.UUID, thread_name: str, bounded: bool = True):
+    # Turns of one thread run one after another against the same checkpoint, each in an admission slot
+    async with turn_slot(thread_id, bounded):
+        res = await agent.ainvoke({"messages": [("human", user_input)]},
+                                  config={"configurable": {"thread_id": str(thread_id), "thread_name": thread_name}})
 
-    await process_ai_messages(res['messages'], thread_id)
+        await persist_turn(res['messages'], thread_id, thread_name)
     sources = await process_sources(res['messages'])
 
     return res['messages'][-1].content if res['messages'] else None, sources
@@ -244,15 +296,197 @@ async def run_ai(user_input: UserInput):
             "response": response,
             "sources": sources
         }
+    except AdmissionRejected as e:
+        raise admission_error(e)
     except Exception as e:
         print(f"Error running AI thread: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream_ai_thread(user_input: str, thread_id: uuid.UUID, thread_name: str, release):
+    """Run the agent and yield Server-Sent Events as tokens and tool calls happen.
+
+    `release` gives back the thread lock and admission slot taken before the response started.
+    """
+    config = {"configurable": {"thread_id": str(thread_id), "thread_name": thread_name}}
+
+    try:
+        async for event in agent.astream_events({"messages": [("human", user_input)]}, config=config, version="v2"):
+            kind = event["event"]
+            node = event.get("metadata", {}).get("langgraph_node")
+
+            # Only forward tokens produced by the assistant node, not the LLM nested inside the retriever tool
+            if kind == "on_chat_model_stream" and node == "assistant":
+                content = event["data"]["chunk"].content
+                if content:
+                    yield format_sse("token", {"content": content})
+            elif kind == "on_tool_start":
+                yield format_sse("tool_start", {"name": event["name"], "input": event["data"].get("input")})
+            elif kind == "on_tool_end":
+                yield format_sse("tool_end", {"name": event["name"]})
+
+        state = await agent.aget_state(config)
+        messages = state.values.get("messages", [])
+
+        await persist_turn(messages, thread_id, thread_name)
+        await release()
+
+        sources = await process_sources(messages)
+
+        yield format_sse("sources", {"sources": sources})
+        yield format_sse("done", {"response": messages[-1].content if messages else None})
+    except Exception as e:
+        print(f"Error streaming AI thread: {str(e)}")
+        yield format_sse("error", {"detail": str(e)})
+    finally:
+        await release()
+
+
+@app.post("/run_ai_thread/stream/")
+async def run_ai_stream(user_input: UserInput):
+    print(f"Received streaming input: {user_input}")
+    try:
+        release = await acquire_turn(user_input.thread_id)
+    except AdmissionRejected as e:
+        raise admission_error(e)
+
+    return StreamingResponse(
+        stream_ai_thread(user_input.user_input, user_input.thread_id, user_input.thread_name, release),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also frees the lock and slot if the client disconnects before the stream starts
+        background=BackgroundTask(release),
+    )
+
+
+async def run_job(user_input: str, thread_id: str, thread_name: str) -> dict:
+    # Jobs share the global cap on concurrent agent runs with the request endpoints
+    response, sources = await run_ai_thread(user_input, uuid.UUID(thread_id), thread_name, bounded=False)
+    return {"response": response, "sources": sources}
+
+
+job_manager = JobManager(run_job)
+
+
+@app.post("/jobs/run_ai_thread/")
+async def submit_ai_job(user_input: UserInput):
+    """Queue an agent run and return its job id immediately; poll or subscribe for the result."""
+    try:
+        record = await job_manager.submit({
+            "user_input": user_input.user_input,
+            "thread_id": str(user_input.thread_id),
+            "thread_name": user_input.thread_name,
+        })
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    return {"job_id": record["job_id"], "status": record["status"]}
+
+
+@app.get("/jobs/{job_id}")
+async def get_ai_job(job_id: str):
+    record = await job_manager.get(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return record
+
+
+@app.get("/jobs/{job_id}/events")
+async def subscribe_ai_job(job_id: str):
+    if await job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def events():
+        async for record in job_manager.events(job_id):
+            yield format_sse("status", record)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.get("/charts/{chart_key}.svg")
+async def get_chart(chart_key: str):
+    # Keys are content hashes, so a URL always maps to the same image and can be cached forever
+    if not re.fullmatch(r"[0-9a-f]{32}", chart_key):
+        raise HTTPException(status_code=404, detail="Chart not found.")
+
+    svg = chart_store.get(chart_key)
+    if svg is None:
+        raise HTTPException(status_code=404, detail="Chart not found.")
+    return Response(content=svg, media_type="image/svg+xml",
+                    headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+
+@app.get("/ready")
+async def ready():
+    if not chatbot_tools.is_ready():
+        raise HTTPException(status_code=503, detail="Still loading the vector store and model clients.")
+    return {"status": "ready"}
+
+
 @app.get("/threads/", response_model=list[ListThreads])
-async def list_threads(db: AsyncSession = Depends(get_db)):
+async def list_threads(
+    limit: int = Query(default=THREADS_PAGE_SIZE, ge=1, le=THREADS_MAX_PAGE_SIZE),
+    before: Optional[datetime] = None,
+    before_id: Optional[uuid.UUID] = None,
+    db: AsyncSession = Depends(get_db)
+):
+    """List threads by most recent activity. Pass the last item's last_message_at/thread_id
+    as before/before_id to fetch the next page."""
+    if before_id is not None and before is None:
+        raise HTTPException(status_code=422, detail="before_id can only be used together with before.")
+
+    params = {"limit": limit, "preview_length": THREAD_PREVIEW_LENGTH}
+
+    cursor_clause = ""
+    if before is not None and before_id is not None:
+        cursor_clause = "WHERE (last_message_at, thread_id) < (:before, :before_id)"
+        params.update(before=before, before_id=before_id)
+    elif before is not None:
+        cursor_clause = "WHERE last_message_at < :before"
+        params["before"] = before
+
     try:
-        result = await db.execute(text("SELECT thread_id, name FROM threads"))
-        return [{"thread_id": thread.thread_id, "name": thread.name} for thread in result.fetchall()]
+        result = await db.execute(
+            text(f"""
+                SELECT t.thread_id, t.name, t.created_at, t.last_message_at,
+                       counts.message_count, preview.last_message
+                FROM (
+                    SELECT thread_id, name, created_at, last_message_at
+                    FROM threads
+                    {cursor_clause}
+                    ORDER BY last_message_at DESC, thread_id DESC
+                    LIMIT :limit
+                ) t
+                LEFT JOIN LATERAL (
+                    SELECT count(*) AS message_count
+                    FROM messages m
+                    WHERE m.thread_id = t.thread_id AND m.role != 'Tool'
+                ) counts ON true
+                LEFT JOIN LATERAL (
+                    SELECT left(m.message_content, :preview_length) AS last_message
+                    FROM messages m
+                    WHERE m.thread_id = t.thread_id AND m.role != 'Tool'
+                    ORDER BY m.id DESC
+                    LIMIT 1
+                ) preview ON true
+                ORDER BY t.last_message_at DESC, t.thread_id DESC
+            """),
+            params
+        )
+        return [
+            {
+                "thread_id": thread.thread_id,
+                "name": thread.name,
+                "created_at": thread.created_at,
+                "last_message_at": thread.last_message_at,
+                "message_count": thread.message_count,
+                "last_message": thread.last_message,
+            }
+            for thread in result.fetchall()
+        ]
     except Exception as e:
         # Log the error if necessary
         raise HTTPException(status_code=500, detail="An error occurred while fetching threads: " + str(e))
@@ -271,16 +505,31 @@ async def create_thread():
 @app.post("/messages/", response_model=list[MessageListResponse])
 async def get_messages(thread_request: ThreadRequest, db: AsyncSession = Depends(get_db)):
     thread_id = thread_request.thread_id
+    params = {"thread_id": thread_id, "limit": thread_request.limit}
+
+    before_clause = ""
+    if thread_request.before_id is not None:
+        before_clause = "AND id < :before_id"
+        params["before_id"] = thread_request.before_id
 
     try:
+        # Walk the (thread_id, id) index backwards for one page, then return it in chronological order
         result = await db.execute(
-            text("SELECT * FROM messages WHERE thread_id = :thread_id AND role != 'Tool'"),
-            {"thread_id": thread_id}
+            text(f"""
+                SELECT * FROM (
+                    SELECT * FROM messages
+                    WHERE thread_id = :thread_id AND role != 'Tool' {before_clause}
+                    ORDER BY id DESC
+                    LIMIT :limit
+                ) page
+                ORDER BY id
+            """),
+            params
         )
 
         messages = result.fetchall()
 
-        if not messages:
+        if not messages and thread_request.before_id is None:
             raise HTTPException(status_code=404, detail="No messages found for this thread ID.")
 
         return [
@@ -293,6 +542,8 @@ async def get_messages(thread_request: ThreadRequest, db: AsyncSession = Depends
             )
             for message in messages
         ]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail="An error occurred while fetching messages: " + str(e))
 
@@ -0,0 +1,30 @@
+"""add messages thread_id index
+
+Revision ID: 3f1c9a7d2b41
+Revises: 2878a3a212c2
+Create Date: 2026-10-18 09:12:41.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c9a7d2b41'
+down_revision: Union[str, None] = '2878a3a212c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = inspect(op.get_bind())
+
+    # Composite index backing keyset pagination of a thread's messages
+    if 'ix_messages_thread_id_id' not in [index['name'] for index in inspector.get_indexes('messages')]:
+        op.create_index('ix_messages_thread_id_id', 'messages', ['thread_id', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_thread_id_id', table_name='messages')
@@ -0,0 +1,40 @@
+"""add thread activity columns
+
+Revision ID: 8d4e2f6a1c07
+Revises: 3f1c9a7d2b41
+Create Date: 2026-10-18 10:03:27.540912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d4e2f6a1c07'
+down_revision: Union[str, None] = '3f1c9a7d2b41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    inspector = inspect(op.get_bind())
+    columns = [column['name'] for column in inspector.get_columns('threads')]
+
+    if 'created_at' not in columns:
+        op.add_column('threads', sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False))
+
+    if 'last_message_at' not in columns:
+        op.add_column('threads', sa.Column('last_message_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False))
+
+    # Supports listing threads by most recent activity with a keyset cursor
+    if 'ix_threads_last_message_at' not in [index['name'] for index in inspector.get_indexes('threads')]:
+        op.create_index('ix_threads_last_message_at', 'threads', ['last_message_at', 'thread_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_threads_last_message_at', table_name='threads')
+    op.drop_column('threads', 'last_message_at')
+    op.drop_column('threads', 'created_at')
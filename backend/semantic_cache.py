@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+
+from hybrid_search import tokenize
+
+
+def code_terms(query: str) -> frozenset:
+    """Product and test codes in a query (tokens containing a digit, e.g. "d6927").
+
+    Embeddings score "ASTM D6927" and "ASTM D6931" as near-identical, so a cached answer is only
+    reused when these terms match exactly.
+    """
+    return frozenset(token for token in tokenize(query) if any(char.isdigit() for char in token))
+
+
+def index_fingerprint(folder_path: str) -> tuple:
+    """Cheap signature of the files in a vector store folder; changes whenever it is rebuilt."""
+    try:
+        entries = sorted(os.scandir(folder_path), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return ()
+    return tuple((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in entries if entry.is_file())
+
+
+class SemanticCache:
+    """LRU + TTL cache of answers keyed by query embeddings.
+
+    A lookup returns the answer of the most similar previous query with the same `terms` if its
+    cosine similarity is at least `threshold`. The whole cache is dropped when the watched vector
+    store folder changes.
+    """
+
+    def __init__(self, embeddings, index_path: str, threshold: float = 0.95, ttl: float = 3600,
+                 maxsize: int = 1000):
+        self.embeddings = embeddings
+        self.index_path = index_path
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._fingerprint = index_fingerprint(index_path)
+        self._lock = threading.Lock()
+
+    def embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _invalidate_if_rebuilt(self):
+        fingerprint = index_fingerprint(self.index_path)
+        if fingerprint != self._fingerprint:
+            print("Vector store changed, clearing semantic cache.")
+            self._entries.clear()
+            self._fingerprint = fingerprint
+
+    def lookup(self, vector: np.ndarray, terms: frozenset = frozenset()) -> Optional[Any]:
+        with self._lock:
+            self._invalidate_if_rebuilt()
+
+            now = time.monotonic()
+            for key in [key for key, (_, _, _, expires_at) in self._entries.items() if expires_at <= now]:
+                del self._entries[key]
+
+            keys = [key for key, entry in self._entries.items() if entry[1] == terms]
+            if not keys:
+                return None
+
+            matrix = np.stack([self._entries[key][0] for key in keys])
+            scores = matrix @ vector
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+
+            self._entries.move_to_end(keys[best])
+            return self._entries[keys[best]][2]
+
+    def update(self, vector: np.ndarray, value: Any, terms: frozenset = frozenset()):
+        with self._lock:
+            self._entries[self._next_key] = (vector, terms, value, time.monotonic() + self.ttl)
+            self._next_key += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,8 +1,12 @@
 import os
 import uuid
 import json
+import hashlib
+import argparse
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.schema import Document
@@ -10,8 +14,12 @@ import openai
 from langchain.text_splitter import CharacterTextSplitter
 import docx2txt
 from PyPDF2 import PdfReader
+from pypdf import PdfReader as PyPdfReader
 import psycopg2
 from Crypto.Cipher import AES
+from embedding_cache import CachedEmbeddings
+from vector_index import INDEX_TYPES, export_index, exported_types, remove_exports
+from hybrid_search import BM25Index
 
 load_dotenv()
 
@@ -19,6 +27,29 @@ load_dotenv()
 database_url = os.getenv('DATABASE_URL')
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+doc_folder = "path_to_your_docs"
+index_name = "faiss.index"
+manifest_name = "manifest.json"
+bm25_name = f"{index_name}.bm25.pkl"
+
+# Extraction fans out per file, and per page range for PDFs longer than this
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '1'))
+PAGES_PER_TASK = int(os.getenv('PAGES_PER_TASK', '50'))
+
+# Chunks are embedded this many at a time, and progress is saved every CHECKPOINT_EVERY batches
+EMBED_BATCH_SIZE = int(os.getenv('EMBED_BATCH_SIZE', '256'))
+CHECKPOINT_EVERY = int(os.getenv('CHECKPOINT_EVERY', '10'))
+
+# Stable namespace so a file's chunk ids only change when its path or content changes
+CHUNK_NAMESPACE = uuid.UUID("6f1d3c52-8a4e-4b7a-9d0e-2c5b7f9a1e34")
+
+text_splitter = CharacterTextSplitter(
+    separator="\n",
+    chunk_size=1000,
+    chunk_overlap=150,
+    length_function=len
+)
+
 
 def connect_db():
     try:
@@ -30,109 +61,240 @@ def connect_db():
         return None
 
 
+def iter_document_files(doc_folder):
+    for root, dirs, files in os.walk(doc_folder):
+        for file in sorted(files):
+            if file.lower().endswith(('.pdf', '.docx')):
+                yield os.path.join(root, file)
+
+
+def load_pdf_pages(file_path, start=0, end=None):
+    """Extract pages [start, end) of a PDF, one Document per page.
+
+    Whole-file and page-range tasks both go through here, so the indexed text doesn't depend on
+    how many workers split the file. Unencrypted files are read with pypdf, the library behind
+    PyPDFLoader; encrypted ones are decrypted with PyPDF2.
+    """
+    documents = []
+    with open(file_path, 'rb') as f:
+        reader = PdfReader(f)
+        if reader.is_encrypted:
+            try:
+                reader.decrypt("")  # Decrypt without a password
+            except Exception as decryption_error:
+                print(f"Failed to decrypt {file_path}: {decryption_error}")
+                return documents
+        else:
+            reader = PyPdfReader(f)
+
+        end = len(reader.pages) if end is None else min(end, len(reader.pages))
+        for page_number in range(start, end):
+            documents.append(Document(page_content=reader.pages[page_number].extract_text(),
+                                      metadata={"source": file_path, "page": page_number}))
+    return documents
+
+
+def load_file(file_path):
+    """Extract the text of one PDF or DOCX file as a list of Documents."""
+    documents = []
+
+    if file_path.lower().endswith('.pdf'):
+        try:
+            documents = load_pdf_pages(file_path)
+            print(f"Successfully processed PDF: {file_path}.")
+        except Exception as e:
+            print(f"Error processing PDF {file_path}: {e}")
+
+    elif file_path.lower().endswith('.docx'):
+        try:
+            text = docx2txt.process(file_path)
+            documents.append(Document(page_content=text, metadata={"source": file_path}))
+            print(f"Successfully processed DOCX: {file_path}.")
+        except Exception as e:
+            print(f"Error processing DOCX {file_path}: {e}")
+
+    return documents
+
+
+def load_page_range(file_path, start, end):
+    """Extract pages [start, end) of a PDF; used to split very large PDFs across workers."""
+    try:
+        return load_pdf_pages(file_path, start, end)
+    except Exception as e:
+        print(f"Error processing pages {start}-{end} of PDF {file_path}: {e}")
+        return []
+
+
+def plan_extraction_tasks(file_paths, pages_per_task=PAGES_PER_TASK):
+    """Turn files into (file_path, start, end) tasks; start/end are None for whole-file tasks."""
+    tasks = []
+    for file_path in file_paths:
+        page_count = 0
+        if pages_per_task and file_path.lower().endswith('.pdf'):
+            try:
+                with open(file_path, 'rb') as f:
+                    reader = PdfReader(f)
+                    if reader.is_encrypted:
+                        reader.decrypt("")
+                    page_count = len(reader.pages)
+            except Exception:
+                # Let the whole-file task report the error
+                page_count = 0
+
+        if page_count > pages_per_task:
+            for start in range(0, page_count, pages_per_task):
+                tasks.append((file_path, start, min(start + pages_per_task, page_count)))
+        else:
+            tasks.append((file_path, None, None))
+    return tasks
+
+
+def run_extraction_task(task):
+    file_path, start, end = task
+    started = time.perf_counter()
+    if start is None:
+        documents = load_file(file_path)
+    else:
+        documents = load_page_range(file_path, start, end)
+    return file_path, documents, time.perf_counter() - started
+
+
+def ordered_imap(executor, fn, items, window):
+    """Like executor.map, but keeps at most `window` tasks in flight so finished results
+    never pile up in memory ahead of the consumer."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def load_documents(file_paths, workers=INGEST_WORKERS, pages_per_task=PAGES_PER_TASK):
+    """Yield (file_path, documents) for each file in the given order, extracting in a process pool.
+
+    A failing file only loses its own documents; the rest of the run is unaffected.
+    """
+    file_paths = list(file_paths)
+    started = time.perf_counter()
+    busy_time = 0.0
+
+    if workers > 1:
+        tasks = plan_extraction_tasks(file_paths, pages_per_task)
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = ordered_imap(executor, run_extraction_task, tasks, window=workers * 2)
+    else:
+        executor = None
+        results = map(run_extraction_task, [(file_path, None, None) for file_path in file_paths])
 
-def load_and_split_documents(doc_folder):
+    try:
+        current_path, current_documents = None, []
+        for file_path, documents, elapsed in results:
+            busy_time += elapsed
+            # Page-range tasks of one file come back consecutively, stitch them together
+            if file_path != current_path:
+                if current_path is not None:
+                    yield current_path, current_documents
+                current_path, current_documents = file_path, []
+            current_documents.extend(documents)
+
+        if current_path is not None:
+            yield current_path, current_documents
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    wall_time = time.perf_counter() - started
+    print(f"Extracted {len(file_paths)} files in {wall_time:.2f}s with {workers} worker(s) "
+          f"({busy_time:.2f}s of extraction work, {busy_time / wall_time if wall_time else 0:.1f}x speedup).")
+
+
+def load_and_split_documents(doc_folder, workers=INGEST_WORKERS):
     all_documents = []
 
-    for root, dirs, files in os.walk(doc_folder):
-        for file in files:
-            file_path = os.path.join(root, file)
-
-            if file.lower().endswith('.pdf'):
-                try:
-                    with open(file_path, 'rb') as f:
-                        reader = PdfReader(f)
-                        if reader.is_encrypted:
-                            print(f"PDF {file_path} is encrypted, attempting decryption...")
-                            try:
-                                reader.decrypt("")  # Decrypt without a password
-                            except Exception as decryption_error:
-                                print(f"Failed to decrypt {file_path}: {decryption_error}")
-                                continue
-
-                            pages = [page.extract_text() for page in reader.pages]
-                            for page_content in pages:
-                                all_documents.append(
-                                    Document(page_content=page_content, metadata={"source": file_path}))
-                        else:
-                            loader = PyPDFLoader(file_path, extract_images=False)
-                            pages = loader.load()
-
-                            for page in pages:
-                                all_documents.append(
-                                    Document(page_content=page.page_content, metadata={"source": file_path}))
-
-                    print(f"Successfully processed PDF: {file_path}.")
-                except Exception as e:
-                    print(f"Error processing PDF {file_path}: {e}")
-
-
-            elif file.lower().endswith('.docx'):
-                try:
-                    text = docx2txt.process(file_path)
-                    all_documents.append(Document(page_content=text, metadata={"source": file_path}))
-                    print(f"Successfully processed DOCX: {file_path}.")
-                except Exception as e:
-                    print(f"Error processing DOCX {file_path}: {e}")
+    for file_path, documents in load_documents(iter_document_files(doc_folder), workers=workers):
+        all_documents.extend(documents)
 
     return all_documents
 
 
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
-doc_folder = "path_to_your_docs"
 
+def file_id_for(file_path):
+    return str(uuid.uuid5(CHUNK_NAMESPACE, file_path))
 
-folder_name = input("Enter the name for the folder to save the vector store: ")
-folder_path = os.path.join("Path_for_vectorstore", folder_name)
 
+def chunk_ids_for(folder_name, file_path, content_hash, count):
+    # The store name is part of the id so two stores built from the same documents never share rows
+    return [str(uuid.uuid5(CHUNK_NAMESPACE, f"{folder_name}:{file_path}:{content_hash}:{i}")) for i in range(count)]
 
-os.makedirs(folder_path, exist_ok=True)
 
+def load_manifest(folder_path):
+    """The manifest maps each indexed file to its content hash, mtime and chunk vector ids."""
+    path = os.path.join(folder_path, manifest_name)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
 
-loaded_documents = load_and_split_documents(doc_folder)
 
-text_splitter = CharacterTextSplitter(
-    separator="\n",
-    chunk_size=1000,
-    chunk_overlap=150,
-    length_function=len
-)
+def save_manifest(folder_path, manifest):
+    path = os.path.join(folder_path, manifest_name)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{path}.tmp", path)
 
 
-docs = text_splitter.split_documents(loaded_documents)
+def plan_changes(doc_folder, manifest):
+    """Compare the folder with the manifest; returns (changed files with hashes, removed file paths)."""
+    changed = {}
+    seen = set()
 
-embeddings = OpenAIEmbeddings()
+    for file_path in iter_document_files(doc_folder):
+        seen.add(file_path)
+        mtime = os.path.getmtime(file_path)
+        entry = manifest.get(file_path)
 
+        if entry and entry["mtime"] == mtime:
+            continue
 
-vectordb = FAISS.from_documents(
-    documents=docs,
-    embedding=embeddings
-)
+        content_hash = file_hash(file_path)
+        if entry and entry["hash"] == content_hash:
+            # Touched but not modified, only refresh the recorded mtime
+            entry["mtime"] = mtime
+            continue
 
+        changed[file_path] = (content_hash, mtime)
 
-index_name = "faiss.index"
-vectordb.save_local(folder_path, index_name)
+    removed = [file_path for file_path in manifest if file_path not in seen]
+    return changed, removed
 
-def accumulate_vectors(docs, folder_name):
+
+def accumulate_vectors(docs, ids, folder_name):
     """Accumulate the vector data from documents."""
-    vector_data=[]
-    for doc in docs:
+    vector_data = []
+    for doc, vector_id in zip(docs, ids):
 
-        vector_id = str(uuid.uuid4())
-        file_id = str(uuid.uuid4())
+        file_id = file_id_for(doc.metadata["source"])
 
         metadata = doc.metadata
         metadata_str = json.dumps(metadata)
 
         vector_data.append((vector_id, file_id, folder_name, metadata_str))
-        break
 
     return vector_data
 
 
 def insert_vectors_batch(conn, vector_data):
     """Insert vector data into PostgreSQL database in a single batch."""
-    print(f"this is the vector data :{vector_data}")
+    print(f"Inserting {len(vector_data)} vector rows.")
     with conn.cursor() as cursor:
         try:
             insert_query = """
@@ -142,22 +304,183 @@ def insert_vectors_batch(conn, vector_data):
             cursor.executemany(insert_query, vector_data)
             print(f"Inserted {len(vector_data)} vectors into database.")
         except Exception as e:
+            # Abort the build: carrying on would record these files as indexed in the manifest
             print(f"Error during batch insertion: {e}")
             conn.rollback()
+            raise
 
 
-conn = connect_db()
-
-if conn:
-
-    vector_data = accumulate_vectors(docs, folder_name)
-
-
-    if vector_data:
-        insert_vectors_batch(conn, vector_data)
-        conn.commit()
+def delete_vectors_batch(conn, folder_name, vector_ids=None):
+    """Delete vector rows of one vector store by id, or all of them when rebuilding it from scratch."""
+    with conn.cursor() as cursor:
+        try:
+            if vector_ids is not None:
+                cursor.execute("DELETE FROM vector WHERE vector_id = ANY(%s) AND name = %s",
+                               (list(vector_ids), folder_name))
+            else:
+                cursor.execute("DELETE FROM vector WHERE name = %s", (folder_name,))
+            print(f"Deleted {cursor.rowcount} vectors from database.")
+        except Exception as e:
+            print(f"Error during batch deletion: {e}")
+            conn.rollback()
+            raise
+
+
+def save_bm25_index(vectordb, folder_path):
+    """Rebuild the keyword index from every chunk currently in the FAISS docstore."""
+    ids = list(vectordb.index_to_docstore_id.values())
+    texts = [vectordb.docstore.search(doc_id).page_content for doc_id in ids]
+    BM25Index.build(ids, texts).save(os.path.join(folder_path, bm25_name))
+    print(f"BM25 index saved with {len(ids)} chunks.")
+
+
+def build_vector_store(doc_folder, folder_path, folder_name, embeddings, incremental=False, workers=INGEST_WORKERS,
+                       batch_size=EMBED_BATCH_SIZE, checkpoint_every=CHECKPOINT_EVERY):
+    """Build or update the FAISS index in folder_path and record every chunk in the vector table.
+
+    Files stream through load -> split -> embed in batches of `batch_size` chunks -> append to the
+    index, so memory stays flat regardless of corpus size. Every `checkpoint_every` batches the
+    index, manifest and vector rows are saved together; an interrupted build resumes from the last
+    checkpoint when re-run with incremental=True.
+
+    In incremental mode only files whose content changed since the last run are re-embedded, and
+    the vectors of deleted or changed files are removed from the index.
+    """
+    index_exists = os.path.exists(os.path.join(folder_path, f"{index_name}.faiss"))
+    incremental = incremental and index_exists
+
+    manifest = load_manifest(folder_path) if incremental else {}
+    vectordb = None
+    if incremental:
+        vectordb = FAISS.load_local(folder_path, embeddings, index_name, allow_dangerous_deserialization=True)
+
+    changed, removed = plan_changes(doc_folder, manifest)
+    print(f"{len(changed)} new or changed files, {len(removed)} removed files.")
+
+    conn = connect_db()
+    if conn and not incremental:
+        delete_vectors_batch(conn, folder_name)
+
+    stale_ids = []
+    for file_path in removed + [path for path in changed if path in manifest]:
+        stale_ids.extend(manifest.pop(file_path)["ids"])
+
+    if vectordb is not None and stale_ids:
+        known_ids = set(vectordb.index_to_docstore_id.values())
+        vectordb.delete([vector_id for vector_id in stale_ids if vector_id in known_ids])
+    if conn and stale_ids:
+        delete_vectors_batch(conn, folder_name, vector_ids=stale_ids)
+
+    pending_docs, pending_ids, pending_entries = [], [], {}
+    batches_since_checkpoint = 0
+    total_chunks = 0
+
+    def flush():
+        """Embed the pending chunks batch by batch and append them to the index."""
+        nonlocal vectordb, batches_since_checkpoint
+        for start in range(0, len(pending_docs), batch_size):
+            batch_docs = pending_docs[start:start + batch_size]
+            batch_ids = pending_ids[start:start + batch_size]
+            texts = [doc.page_content for doc in batch_docs]
+            text_embeddings = list(zip(texts, embeddings.embed_documents(texts)))
+            metadatas = [doc.metadata for doc in batch_docs]
+
+            if vectordb is None:
+                vectordb = FAISS.from_embeddings(text_embeddings, embeddings, metadatas=metadatas, ids=batch_ids)
+            else:
+                vectordb.add_embeddings(text_embeddings, metadatas=metadatas, ids=batch_ids)
+            batches_since_checkpoint += 1
+
+        # A file only enters the manifest once all of its chunks are in the index
+        manifest.update(pending_entries)
+        if conn:
+            insert_vectors_batch(conn, accumulate_vectors(pending_docs, pending_ids, folder_name))
+
+        pending_docs.clear()
+        pending_ids.clear()
+        pending_entries.clear()
+
+    def checkpoint():
+        nonlocal batches_since_checkpoint
+        if vectordb is not None:
+            vectordb.save_local(folder_path, index_name)
+        save_manifest(folder_path, manifest)
+        if conn:
+            conn.commit()
+        batches_since_checkpoint = 0
+        print(f"Checkpoint saved: {total_chunks} chunks indexed so far.")
+
+    for file_path, documents in load_documents(changed, workers=workers):
+        content_hash, mtime = changed[file_path]
+        chunks = text_splitter.split_documents(documents)
+        if not chunks:
+            # Leave unreadable or empty files out of the manifest so the next run retries them
+            continue
+        ids = chunk_ids_for(folder_name, file_path, content_hash, len(chunks))
+        # Chunk positions let the retriever stitch neighbouring chunks back together
+        for position, chunk in enumerate(chunks):
+            chunk.metadata["chunk"] = position
+
+        pending_entries[file_path] = {"hash": content_hash, "mtime": mtime, "ids": ids}
+        pending_docs.extend(chunks)
+        pending_ids.extend(ids)
+        total_chunks += len(chunks)
+
+        # Only flush at file boundaries so the manifest never records a partially indexed file
+        if len(pending_docs) >= batch_size:
+            flush()
+            if batches_since_checkpoint >= checkpoint_every:
+                checkpoint()
+
+    flush()
+    checkpoint()
+
+    if vectordb is not None:
+        save_bm25_index(vectordb, folder_path)
+
+    if conn:
         print(f"Vectors saved successfully in the PostgreSQL database.")
-
-    conn.close()
-
-print(f"Vector store saved successfully in '{folder_path}' with index file name '{index_name}'.")
+        conn.close()
+
+    return vectordb
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the FAISS vector store from a folder of PDF and DOCX files.")
+    parser.add_argument("folder_name", nargs="?", help="Name of the folder to save the vector store in.")
+    parser.add_argument("--docs", default=doc_folder, help="Folder containing the source documents.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-embed new or changed files and drop vectors of deleted ones. "
+                             "Also resumes an interrupted build from its last checkpoint.")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS,
+                        help="Number of processes used to extract text from the documents.")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="Number of chunks sent to the embedding API per request.")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat",
+                        help="Also export an approximate IVF, HNSW or product-quantized index for serving. "
+                             "Previously exported types are re-exported on every build.")
+    args = parser.parse_args()
+
+    folder_name = args.folder_name or input("Enter the name for the folder to save the vector store: ")
+    folder_path = os.path.join("Path_for_vectorstore", folder_name)
+
+    os.makedirs(folder_path, exist_ok=True)
+
+    # Chunks embedded by a previous build are read back from the local cache
+    embeddings = CachedEmbeddings(OpenAIEmbeddings())
+
+    vectordb = build_vector_store(args.docs, folder_path, folder_name, embeddings,
+                                  incremental=args.incremental, workers=args.workers, batch_size=args.batch_size)
+
+    # The flat index stays the source of truth for incremental updates; other types are derived from it.
+    # Types exported by earlier builds are rebuilt too, since their positions no longer match the docstore.
+    export_types = set(exported_types(folder_path, index_name))
+    if args.index_type != "flat":
+        export_types.add(args.index_type)
+    if vectordb is None:
+        remove_exports(folder_path, index_name)
+    else:
+        for index_type in sorted(export_types):
+            export_index(vectordb, folder_path, index_name, index_type)
+
+    print(f"Vector store saved successfully in '{folder_path}' with index file name '{index_name}'.")
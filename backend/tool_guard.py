@@ -0,0 +1,128 @@
+import asyncio
+import time
+import httpx
+from langchain_core.tools import BaseTool, StructuredTool
+from chatbot_tools import CHART_RENDERER
+from http_client import UpstreamError
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Tools that share an upstream service share its circuit breaker
+TOOL_UPSTREAMS = {
+    "list_contacts": "contacts",
+    "create_contact": "contacts",
+    "get_contact_details": "contacts",
+    "find_contact": "contacts",
+    "send_email": "mail",
+}
+# Local rendering has no upstream service that could be down
+if CHART_RENDERER != "local":
+    TOOL_UPSTREAMS["generate_chart"] = "chart"
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and fails fast for `reset_timeout`
+    seconds, then lets a single trial call through before closing again."""
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.trial_running = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                print(f"Circuit breaker for {self.name} opened after {self.failures} failures.")
+            self.opened_at = time.monotonic()
+
+
+breakers = {upstream: CircuitBreaker(upstream) for upstream in set(TOOL_UPSTREAMS.values())}
+
+
+def tool_timeout(name: str) -> float:
+    return float(os.getenv(f"TOOL_TIMEOUT_{name.upper()}", TOOL_TIMEOUT))
+
+
+def guard_tool(tool: BaseTool) -> BaseTool:
+    """Wrap a tool with a deadline and its upstream's circuit breaker.
+
+    Timeouts, transport errors, 5xx responses (raised as UpstreamError by the tools) and open
+    circuits come back to the model as an error result instead of stalling the turn; other
+    exceptions are re-raised for the ToolNode fallback after counting as a failure.
+    """
+    breaker = breakers.get(TOOL_UPSTREAMS.get(tool.name))
+    timeout = tool_timeout(tool.name)
+
+    def error_result(message: str):
+        if tool.response_format == "content_and_artifact":
+            return f"Error: {message}", []
+        return {"error": message}
+
+    async def run(**kwargs):
+        if breaker is not None and not breaker.allow():
+            return error_result(f"The {breaker.name} service is temporarily unavailable, try again later.")
+
+        if tool.coroutine is not None:
+            call = tool.coroutine(**kwargs)
+        else:
+            call = asyncio.to_thread(tool.func, **kwargs)
+
+        try:
+            result = await asyncio.wait_for(call, timeout=timeout)
+        except asyncio.TimeoutError:
+            if breaker is not None:
+                breaker.record_failure()
+            return error_result(f"{tool.name} did not respond within {timeout:g} seconds.")
+        except (httpx.HTTPError, UpstreamError) as e:
+            if breaker is not None:
+                breaker.record_failure()
+            return error_result(f"{tool.name} failed: {e}")
+        except asyncio.CancelledError:
+            if breaker is not None:
+                breaker.trial_running = False
+            raise
+        except Exception:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+    return StructuredTool.from_function(
+        coroutine=run,
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        response_format=tool.response_format,
+    )
+
+
+def guard_tools(tools: list) -> list:
+    return [guard_tool(tool) for tool in tools]
@@ -0,0 +1,119 @@
+import math
+import os
+import pickle
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "pq")
+
+# Search-time accuracy/speed knobs for the approximate index types
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "64"))
+FAISS_HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+FAISS_PQ_M = int(os.getenv("FAISS_PQ_M", "64"))
+
+
+def index_file(folder_path: str, index_name: str, index_type: str = "flat") -> str:
+    # The flat index is the one written by FAISS.save_local; other types sit next to it
+    if index_type == "flat":
+        return os.path.join(folder_path, f"{index_name}.faiss")
+    return os.path.join(folder_path, f"{index_name}.{index_type}.faiss")
+
+
+def factory_string(index_type: str, count: int, dimension: int) -> str:
+    nlist = max(1, min(int(4 * math.sqrt(count)), count // 39 or 1))
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivf":
+        return f"IVF{nlist},Flat"
+    if index_type == "hnsw":
+        return f"HNSW{FAISS_HNSW_M}"
+    if index_type == "pq":
+        pq_m = FAISS_PQ_M if dimension % FAISS_PQ_M == 0 else 8
+        return f"IVF{nlist},PQ{pq_m}"
+    raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+
+def build_index(vectors: np.ndarray, index_type: str):
+    """Build and train a FAISS index of the given type holding `vectors` in the same order."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dimension = vectors.shape
+
+    index = faiss.index_factory(dimension, factory_string(index_type, count, dimension), faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    configure_search(index)
+    return index
+
+
+def configure_search(index):
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = FAISS_EF_SEARCH
+    try:
+        faiss.extract_index_ivf(index).nprobe = FAISS_NPROBE
+    except RuntimeError:
+        pass
+
+
+def export_index(vectordb: FAISS, folder_path: str, index_name: str, index_type: str) -> str:
+    """Write an approximate copy of a saved flat store; positions (and so the docstore mapping) are shared."""
+    vectors = vectordb.index.reconstruct_n(0, vectordb.index.ntotal)
+    path = index_file(folder_path, index_name, index_type)
+    faiss.write_index(build_index(vectors, index_type), path)
+    print(f"Exported {index_type} index with {len(vectors)} vectors to '{path}'.")
+    return path
+
+
+def exported_types(folder_path: str, index_name: str) -> list:
+    """Index types other than flat that have been exported into the folder."""
+    return [index_type for index_type in INDEX_TYPES
+            if index_type != "flat" and os.path.exists(index_file(folder_path, index_name, index_type))]
+
+
+def remove_exports(folder_path: str, index_name: str):
+    for index_type in exported_types(folder_path, index_name):
+        os.remove(index_file(folder_path, index_name, index_type))
+        print(f"Removed stale {index_type} index from '{folder_path}'.")
+
+
+def read_index(path: str, mmap: bool = True):
+    if mmap:
+        try:
+            return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            print(f"Memory-mapped load of '{path}' failed ({e}), reading it into memory instead.")
+    return faiss.read_index(path)
+
+
+def load_vector_store(folder_path: str, index_name: str, embeddings, index_type: str = "flat", mmap: bool = True) -> FAISS:
+    """Load a store saved by FAISS.save_local, optionally swapping in an exported index type.
+
+    An exported index whose size doesn't match the docstore mapping is stale and is skipped in
+    favour of the flat index.
+
+    With mmap=True the index is memory-mapped read-only where the index type supports it, so
+    several workers on one machine share a single copy through the page cache.
+    """
+    with open(os.path.join(folder_path, f"{index_name}.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    index = read_index(index_file(folder_path, index_name, index_type), mmap=mmap)
+    # An exported index that wasn't rebuilt with the store would map positions to the wrong chunks
+    if index_type != "flat" and index.ntotal != len(index_to_docstore_id):
+        print(f"The {index_type} index holds {index.ntotal} vectors but the docstore maps "
+              f"{len(index_to_docstore_id)}; it is out of date, using the flat index instead.")
+        index = read_index(index_file(folder_path, index_name, "flat"), mmap=mmap)
+    configure_search(index)
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
@@ -7,6 +7,8 @@ import { useParams } from "react-router-dom";
 import { Modal } from 'antd';
 import "./Chat.css";
 
+const MESSAGES_PAGE_SIZE = 100;
+
 const Chat = ({ messages, setMessages }) => {
     const { thread_id } = useParams();
     const baseURL = import.meta.env.VITE_API_URL;
@@ -15,6 +17,9 @@ const Chat = ({ messages, setMessages }) => {
     const [jsonData, setJsonData] = useState({});
     const [isModalOpen, setIsModalOpen] = useState(false);
     const [selectedSource, setSelectedSource] = useState(null);
+    const [hasEarlier, setHasEarlier] = useState(false);
+    const [loadingEarlier, setLoadingEarlier] = useState(false);
+    const skipScrollRef = useRef(false);
 
     const handleSourceClick = (source) => {
         setSelectedSource(source.page_content);
@@ -33,8 +38,10 @@ const Chat = ({ messages, setMessages }) => {
                 try {
                     const response = await axios.post(`${baseURL}/messages/`, {
                         thread_id: thread_id,
+                        limit: MESSAGES_PAGE_SIZE,
                     });
                     setMessages(response.data);
+                    setHasEarlier(response.data.length === MESSAGES_PAGE_SIZE);
                     setJsonData(response.data.sources);
                 } catch (error) {
                     console.error("Error fetching messages:", error);
@@ -47,11 +54,39 @@ const Chat = ({ messages, setMessages }) => {
         fetchMessages();
     }, [thread_id, setMessages]);
 
+    const handleLoadEarlier = async () => {
+        // Messages added in this session carry client ids; the cursor is the oldest stored message
+        const oldest = messages.find((msg) => Number.isInteger(msg.id));
+        if (!oldest) {
+            return;
+        }
+        setLoadingEarlier(true);
+        try {
+            const response = await axios.post(`${baseURL}/messages/`, {
+                thread_id: thread_id,
+                before_id: oldest.id,
+                limit: MESSAGES_PAGE_SIZE,
+            });
+            skipScrollRef.current = true;
+            setMessages((prevMessages) => [...response.data, ...prevMessages]);
+            setHasEarlier(response.data.length === MESSAGES_PAGE_SIZE);
+        } catch (error) {
+            console.error("Error fetching earlier messages:", error);
+        } finally {
+            setLoadingEarlier(false);
+        }
+    };
+
     const handleJsonDisplay = (jsonData) => {
         alert(JSON.stringify(jsonData, null, 2));
     };
 
     useEffect(() => {
+        // Keep the reader's place when older messages are prepended
+        if (skipScrollRef.current) {
+            skipScrollRef.current = false;
+            return;
+        }
         if (messagesEndRef.current) {
             messagesEndRef.current.scrollIntoView({ behavior: "smooth" });
         }
@@ -74,6 +109,13 @@ const Chat = ({ messages, setMessages }) => {
                 </div>
             ) : (
                 <div className="scrollable pb-4">
+                    {hasEarlier && (
+                        <div className="flex justify-center mb-4">
+                            <Button onClick={handleLoadEarlier} loading={loadingEarlier}>
+                                {loadingEarlier ? "Loading..." : "Load earlier messages"}
+                            </Button>
+                        </div>
+                    )}
                     {messages.map((msg) => (
                         <div
                             key={msg.id}
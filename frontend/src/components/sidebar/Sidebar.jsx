@@ -7,6 +7,8 @@ import {useNavigate} from "react-router-dom";
 import "./Sidebar.css"
 
 
+const THREADS_PAGE_SIZE = 50;
+
 const Sidebar = ({ onSelectThread }) => {
     const [threads, setThreads] = useState([]);
     const baseURL = import.meta.env.VITE_API_URL;
@@ -15,6 +17,8 @@ const Sidebar = ({ onSelectThread }) => {
     const [error, setError] = useState(null);
     const [selectedMenu, setSelectedMenu] = useState(null);
     const [selectedThreadId, setSelectedThreadId] = useState(null);
+    const [hasMore, setHasMore] = useState(false);
+    const [loadingMore, setLoadingMore] = useState(false);
     const navigate = useNavigate();
 
 
@@ -38,25 +42,42 @@ const Sidebar = ({ onSelectThread }) => {
             />
         ));
     };
-    useEffect(() => {
-        const fetchThreads = async () => {
-            try {
-                const response = await axios.get(`${baseURL}/threads/`);
-                console.log("Response data:", response.data); // Log the response
-
-                // Check if response.data is an array and set it to state
-                if (Array.isArray(response.data)) {
-                    setThreads(response.data.reverse()); // Reverse the array before setting
-                } else {
-                    console.error("Expected an array but received:", response.data);
-                }
-            } catch (error) {
-                console.error("Error fetching threads:", error);
+    const fetchThreads = async (cursor = null) => {
+        setLoadingMore(true);
+        try {
+            const params = { limit: THREADS_PAGE_SIZE };
+            if (cursor) {
+                params.before = cursor.last_message_at;
+                params.before_id = cursor.thread_id;
             }
-        };
+            const response = await axios.get(`${baseURL}/threads/`, { params });
+
+            // Threads come back newest first, one page at a time
+            if (Array.isArray(response.data)) {
+                setThreads((prevThreads) => {
+                    const known = new Set(prevThreads.map((thread) => thread.thread_id));
+                    return [...prevThreads, ...response.data.filter((thread) => !known.has(thread.thread_id))];
+                });
+                setHasMore(response.data.length === THREADS_PAGE_SIZE);
+            } else {
+                console.error("Expected an array but received:", response.data);
+            }
+        } catch (error) {
+            console.error("Error fetching threads:", error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
+    useEffect(() => {
         fetchThreads();
     }, []);
 
+    const handleLoadMore = () => {
+        const lastLoaded = [...threads].reverse().find((thread) => thread.last_message_at);
+        fetchThreads(lastLoaded);
+    };
+
     const handleStartChat = async () => {
         setLoading(true);
         setError(null);
@@ -115,6 +136,15 @@ const Sidebar = ({ onSelectThread }) => {
                 <div
                     className="flex-1 space-y-4 custom-scroll overflow-y-auto border-b border-slate-300 px-2 py-4 dark:border-slate-700">
                     {renderPreviousChats(threads)}
+                    {hasMore && (
+                        <Button
+                            onClick={handleLoadMore}
+                            className="flex w-full rounded-lg"
+                            loading={loadingMore}
+                        >
+                            {loadingMore ? "Loading..." : "Load more"}
+                        </Button>
+                    )}
                 </div>
 
                 <div className="w-full space-y-4 px-2 py-4">